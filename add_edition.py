@@ -0,0 +1,120 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Adds an edition to a finished run without running saturate again: the new
+# edition is aligned to the existing ones only, and each row's best inferer
+# takes its sentence in as one more edition. Outputs and a checkpoint go to
+# a new iteration directory of the run, so editions can be added one after
+# another.
+
+import argparse
+import backends
+import checkpoint
+import os
+import sys
+import time
+
+from aligner import Aligner
+from parser import Parser
+
+def addEdition(parser, aligner, state, fileName):
+    """
+    parser - English parser
+    aligner - Aligner of the run, in file order
+    state - checkpoint of the run, see checkpoint.py
+    fileName - the new edition, line-parallel to the others
+
+    returns the updated state
+    """
+    t0 = time.time()
+    best_inferers = state["best_inferers"]
+    iteration = state["iteration"] + 1
+    aligner.update(iteration)
+    fileiIdx = aligner.addFile(fileName)
+    aligner.createDir(fileiIdx)
+    filei = aligner.read(fileiIdx)
+    for filejIdx in xrange(fileiIdx):
+        aligner.alignWith(fileiIdx, filejIdx, [], state["base_rules"])
+    alignments = aligner.loadAlignments(fileiIdx)
+    t1 = time.time()
+    for row in xrange(aligner.size):
+        inferer = best_inferers[row]
+        # alignments are in file order, the inferer wants its own order
+        suggested = [alignments[filejIdx][row] for filejIdx in inferer.perm]
+        inferer.addEdition(fileiIdx, parser.parse(filei[row]), suggested)
+        inferer.score()
+    t2 = time.time()
+    best_rules = state.get("best_rules", [[] for _ in xrange(aligner.size)])
+    final_alignments = aligner.writeProgress(best_inferers, best_rules, t0)
+    aligner.clean()
+    print ("Total Score {}".format(sum([inferer.getScore() for inferer in best_inferers])))
+    aligner.writeOutputs(best_inferers)
+    state = dict(state)
+    state.update({
+        "iteration": iteration,
+        "best_inferers": best_inferers,
+        "fileNames": [f.name for f in aligner.fileList],
+        "final_alignments": final_alignments,
+        # a finished run stays finished when resumed
+        "converged": True,
+    })
+    checkpoint.save(aligner.currDir, state)
+    print ("Aligning: {} Inferring: {}".format(t1-t0, t2-t1))
+    return state
+
+def parseArgs():
+    argparser = argparse.ArgumentParser(description="Add an edition to a finished monolign run")
+    argparser.add_argument("run_dir", help="_aligns directory of the run")
+    argparser.add_argument("data_dir", help="data directory the run was started on")
+    argparser.add_argument("aligner", help="location of fast_align (unused by --backend model2)")
+    argparser.add_argument("edition", help="the new edition, line-parallel to the others and "
+                           "outside of data_dir")
+    argparser.add_argument("--backend", choices=backends.BACKENDS, default="fast_align",
+                           help="pairwise aligner, see monolign.py")
+    argparser.add_argument("--align-cache", default=None, metavar="DIR",
+                           help="alignment cache to reuse, see monolign.py")
+    argparser.add_argument("--align-cache-budget", type=int, default=2048, metavar="MB",
+                           help="disk budget of the alignment cache")
+    argparser.add_argument("--parse-cache", default=None, metavar="DIR",
+                           help="parse cache to reuse, see monolign.py")
+    argparser.add_argument("--gzip-logs", action="store_true",
+                           help="gzip the logs of the new iteration, see monolign.py")
+    return argparser.parse_args()
+
+if __name__ == "__main__":
+    args = parseArgs()
+    state = checkpoint.latest(args.run_dir)
+    if (state is None):
+        sys.exit("No checkpoint in {}".format(args.run_dir))
+    backend = backends.FastAlignBackend(args.aligner)
+    if (args.backend == backends.Model2Backend.name):
+        backend = backends.Model2Backend()
+    aligner = Aligner(sys.argv[0], args.data_dir, args.aligner, backend, newDir=args.run_dir)
+    aligner.compressLogs = args.gzip_logs
+    if (args.align_cache is not None):
+        aligner.useCache(args.align_cache, args.align_cache_budget * (1 << 20))
+    if not checkpoint.restoreEditions(state, aligner):
+        sys.exit("{} was run on other editions than {}".format(args.run_dir, args.data_dir))
+    if (os.path.basename(args.edition) in aligner.fileNames):
+        sys.exit("{} is already an edition of {}".format(args.edition, args.run_dir))
+    aligner.perm = range(aligner.numFiles)
+    parser = Parser(args.parse_cache)
+    state = addEdition(parser, aligner, state, args.edition)
+    print ("{}\n{}".format(aligner.newDir, state["final_alignments"]))
@@ -0,0 +1,119 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Content addressed cache of alignment stores. An entry is keyed by the
+# contents of both files, the rule lines and the aligner flags, so reruns
+# and iterations with unchanged rules skip the aligner. Entries are shared
+# by concurrent workers through the file system only.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import alignstore
+from alignstore import AlignmentStore
+
+def fileDigest(fileName):
+    digest = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AlignmentCache:
+    """
+    Directory of <key>.bin stores, least recently used first out once the
+    entries take more than budget bytes. A hit touches the entry.
+    cacheDir : string
+    budget : int        Bytes
+    """
+    def __init__(self, cacheDir, budget):
+        self.cacheDir = cacheDir
+        self.budget = budget
+        try:
+            os.mkdir(cacheDir)
+        except OSError:
+            # directory already exists
+            pass
+
+    def keys(self, digest1, digest2, rules, flags):
+        """
+        returns the key of the pair and of the reversed pair
+        """
+        rulesDigest = hashlib.sha1(rules.encode("utf-8")).hexdigest()
+        key = lambda a, b: hashlib.sha1("\n".join(
+            [a, b, rulesDigest, flags]).encode("utf-8")).hexdigest()
+        return (key(digest1, digest2), key(digest2, digest1))
+
+    def path(self, key):
+        return os.path.join(self.cacheDir, "{}.bin".format(key))
+
+    def fetch(self, keys, storePath):
+        """
+        Put the cached store of keys at storePath. A store of the reversed
+        pair is transposed. returns whether there was one
+        """
+        (key, reverseKey) = keys
+        try:
+            shutil.copyfile(self.path(key), storePath)
+            os.utime(self.path(key), None)
+            return True
+        except (IOError, OSError):
+            pass
+        try:
+            reverse = AlignmentStore(self.path(reverseKey), 0)
+            alignstore.writeArrays(storePath, reverse.offsets, reverse.targets, reverse.sources)
+            os.utime(self.path(reverseKey), None)
+        except (IOError, OSError, ValueError):
+            # missing, or evicted meanwhile
+            return False
+        # the transposed store is an entry of its own
+        self.put(key, storePath)
+        return True
+
+    def put(self, key, storePath):
+        # copy then rename, readers never see half an entry
+        (handle, tmpPath) = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        os.close(handle)
+        shutil.copyfile(storePath, tmpPath)
+        os.rename(tmpPath, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cacheDir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum([size for (_, size, _) in entries])
+        for (_, size, name) in sorted(entries):
+            if (total <= self.budget):
+                break
+            try:
+                os.remove(os.path.join(self.cacheDir, name))
+            except OSError:
+                # another worker got there first
+                pass
+            total -= size
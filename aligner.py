@@ -22,14 +22,29 @@ from __future__ import unicode_literals
 # every iteration.
 
 import codecs
+import gzip
+import io
+import json
 import os
 import time
 import sys
 import random 
 
+from aligncache import AlignmentCache, fileDigest
+from alignstore import AlignmentStore, ComposedAlignments
+from backends import FastAlignBackend
 from collections import defaultdict
+from scheduler import AlignmentScheduler
+import alignstore
+import columnar
 
 CLEAN = False
+# inferers whose output lines are held before they are written, see writeOutputs
+WRITE_ROWS = 1024
+PREDICATES = "predicates.jsonl"
+# bytes of a log held before they are written out, see openLog
+LOG_BUFFER = 1 << 20
+LOGS = ["all", "final"]
 
 def passesSimilarity(word1, word2):
     # We can handcraft a similarity function between words instead of
@@ -49,18 +64,50 @@ def collapseRules(rules):
                         allRules.add((relation[j], relation[i]))
     return allRules
 
+def writeRules(write, rules):
+    # write(str(rules)) rule by rule
+    if not isinstance(rules, list):
+        write(str(rules))
+        return
+    write(u"[")
+    for (k, rule) in enumerate(rules):
+        if (k > 0):
+            write(u", ")
+        write(repr(rule))
+    write(u"]")
+
 def lowQuality(pairs):
     return (sum([int(p[0]) for p in pairs]) == 0 or
             sum([int(p[1]) for p in pairs]) == 0)
 
+def runAlignment(backend, file1Name, file2Name, tmpFile, outPrefix, rules,
+                 cache=None, keys=None):
+    # aligns a pair with backend, see backends.py. Module level so that
+    # scheduler workers can run it.
+    if (cache is not None and cache.fetch(keys, "{}.bin".format(outPrefix))):
+        return
+    backend.align(file1Name, file2Name, tmpFile, outPrefix, rules)
+    if (cache is not None):
+        cache.put(keys[0], "{}.bin".format(outPrefix))
+
+    if (CLEAN and os.path.exists(tmpFile)):
+        os.system("rm {}".format(tmpFile))
+
 class Aligner:
-    def __init__(self, srcDir, dataDir, alignerDir):
+    def __init__(self, srcDir, dataDir, alignerDir, backend=None, pivots=0, newDir=None):
         self.aligner = alignerDir # this is a string
+        self.pivots = pivots # 0 aligns all pairs
+        self.backend = backend
+        if (self.backend is None):
+            self.backend = FastAlignBackend(alignerDir)
         self.iteration = 0
-        self.newDir = "{}_aligns{}".format(
-            dataDir[:-1],
-            time.strftime('%S%M%H_%m%d')
-        )
+        # an existing newDir continues a run
+        self.newDir = newDir
+        if (self.newDir is None):
+            self.newDir = "{}_aligns{}".format(
+                dataDir[:-1],
+                time.strftime('%S%M%H_%m%d')
+            )
         try:
             os.mkdir(self.newDir)
         except:
@@ -74,6 +121,11 @@ class Aligner:
                           for f in os.listdir(dataDir)
                           if f.endswith(".txt")]
         self.numFiles = len(self.fileList)
+        self.scheduler = None
+        self.outputFormat = "text" # see columnar.FORMATS
+        self.compressLogs = False # gzip the logs of writeProgress
+        self.cache = None
+        self.digests = None
         self.size = 0
         # assumes all files are equal lengths -- they better be!
         self.perm = range(self.numFiles)
@@ -90,12 +142,15 @@ class Aligner:
             os.system("rm -R -- {}/*/".format(self.currDir))
         
 
-    def update(self, iteration):
+    def update(self, iteration, restart=None):
+        # a restart works in a directory of its own inside the iteration's
         self.iteration = iteration
         self.currDir = "{}/{}".format(
             self.newDir,
             self.iteration
         )
+        if (restart is not None):
+            self.currDir = "{}/restart{}".format(self.currDir, restart)
 
         try:
             os.mkdir(self.currDir)
@@ -107,6 +162,20 @@ class Aligner:
             f.seek(0)
         return
 
+    def addFile(self, fileName):
+        # another edition, last in the current order; returns its file index
+        self.fileList.append(codecs.open(fileName, 'r', encoding='utf-8'))
+        self.fileNames.append(os.path.basename(fileName))
+        self.perm.append(self.numFiles)
+        self.numFiles += 1
+        if (self.digests is not None):
+            self.digests.append(fileDigest(fileName))
+        return self.numFiles - 1
+
+    def reopen(self):
+        # forked processes share file offsets, each needs its own handles
+        self.fileList = [codecs.open(f.name, 'r', encoding='utf-8') for f in self.fileList]
+
     def shuffle(self):
         # specify how many are test, assumes last one is.
         #copy = self.perm[:-1]
@@ -129,34 +198,65 @@ class Aligner:
         return u"\n".join([u"{} ||| {}".format(a, b) for (a,b) in list(allRules)])
                     
 
-    def alignWith(self, file1Idx, file2Idx, new_rules, base_rules):
-        # aligns file1Idxth and file2Idxth files into a separate directory
-        #t0 = time.time()
+    def alignArgs(self, file1Idx, file2Idx, rules):
+        # arguments for runAlignment, aligns file1Idxth and file2Idxth files
         file1dir = "{}/{}".format(self.currDir,
                                   self.fileNames[self.perm[file1Idx]])
         tmpFile = "{}/{}tmp".format(
             file1dir, self.perm[file2Idx]
         )
-        
-        os.system("paste {} {} | sed 's/\t/ ||| /' > {} ".format(
-            self.fileList[self.perm[file1Idx]].name,
-            self.fileList[self.perm[file2Idx]].name,
-            tmpFile
-        ))
-        # add rules >>
-        with codecs.open(tmpFile, 'a', "utf-8") as tmpOpenFile:
-            tmpOpenFile.write(self.formatRules(new_rules, base_rules))
-
-
-        # experiment with alignment args.
-        os.system("{} -i {} -d -o -v 1>{}/{}.align 2>{}/{}.log".format(
-            self.aligner, tmpFile, file1dir, self.fileNames[self.perm[file2Idx]],
-            file1dir, self.fileNames[self.perm[file2Idx]])
-        )
-        
-        if (CLEAN):
-            os.system("rm {}".format(tmpFile))
-        #t1 = time.time()
+        keys = None
+        if (self.cache is not None):
+            keys = self.cache.keys(self.digests[self.perm[file1Idx]],
+                                   self.digests[self.perm[file2Idx]],
+                                   rules, self.backend.flags())
+        return (self.backend,
+                self.fileList[self.perm[file1Idx]].name,
+                self.fileList[self.perm[file2Idx]].name,
+                tmpFile,
+                "{}/{}".format(file1dir, self.fileNames[self.perm[file2Idx]]),
+                rules,
+                self.cache,
+                keys)
+
+    def useCache(self, cacheDir, budget):
+        # reuse alignments of identical pairs, rules and flags, see aligncache.py
+        self.cache = AlignmentCache(cacheDir, budget)
+        self.digests = [fileDigest(f.name) for f in self.fileList]
+
+    def pairSize(self, file1Idx, file2Idx):
+        # bytes of bitext for a pair, used to order the scheduler longest-first
+        return (os.path.getsize(self.fileList[self.perm[file1Idx]].name) +
+                os.path.getsize(self.fileList[self.perm[file2Idx]].name))
+
+    def alignWith(self, file1Idx, file2Idx, new_rules, base_rules):
+        # aligns file1Idxth and file2Idxth files into a separate directory
+        runAlignment(*self.alignArgs(file1Idx, file2Idx,
+                                     self.formatRules(new_rules, base_rules)))
+
+    def startScheduler(self, jobs):
+        self.scheduler = AlignmentScheduler(jobs)
+
+    def stopScheduler(self):
+        if (self.scheduler is not None):
+            self.scheduler.close()
+            self.scheduler = None
+
+    def alignAll(self, new_rules, base_rules):
+        """
+        Hands every (fileiIdx, filejIdx) pair of this iteration to the scheduler.
+        Rules are fixed for the whole iteration, see formatRules.
+        """
+        rules = self.formatRules(new_rules, base_rules)
+        pairs = []
+        for fileiIdx in xrange(self.numFiles):
+            self.createDir(fileiIdx)
+            for filejIdx in self.partners(fileiIdx):
+                pairs.append((self.pairSize(fileiIdx, filejIdx), fileiIdx, filejIdx))
+        pairs.sort(key=lambda p: (-p[0], p[1], p[2]))
+        for (_, fileiIdx, filejIdx) in pairs:
+            self.scheduler.submit((fileiIdx, filejIdx), runAlignment,
+                                  self.alignArgs(fileiIdx, filejIdx, rules))
 
     def predict(self, f):
         # make a dir to put alignments in
@@ -175,96 +275,119 @@ class Aligner:
         
         for fileiIdx in xrange(self.numFiles):
             tmpFile = "{}/{}tmp".format(self.currDir, fileiIdx)
-            os.system("paste {} {} | sed 's/\t/ ||| /' > {} ".format(
-                f.name,
-                self.fileList[fileiIdx].name,
-                tmpFile
-            ))
             # no additional rules
-            os.system("{} -i {} -d -o -v 1>{}/{}.align 2>{}/{}.log".format(
-                self.aligner, tmpFile, self.currDir, self.fileNames[fileiIdx],
-                self.currDir, self.fileNames[fileiIdx])
-            )
-        # load into an array
-        A = [[defaultdict(list) for _ in xrange(self.numFiles)] 
-             for _ in xrange(self.size)]
+            self.backend.align(f.name, self.fileList[fileiIdx].name, tmpFile,
+                               "{}/{}".format(self.currDir, self.fileNames[fileiIdx]), "")
+        # load into an array, A[lineIdx][fileiIdx]
+        stores = []
         for fileiIdx in xrange(self.numFiles):
+            prefix = '{}/{}'.format(self.currDir, self.fileNames[fileiIdx])
             try:
-                document = open('{}/{}.align'.format(
-                    self.currDir,
-                    self.fileNames[fileiIdx]), 'r').read().split("\n")
-                for lineIdx in xrange(self.size):
-                    line = document[lineIdx]
-                    if (len(line) > 0):
-                        pairs = map(lambda x : x.split("-"), line.split(" "))
-                        for pair in pairs:
-                            A[lineIdx][fileiIdx][int(pair[0])].append(int(pair[1]))
+                stores.append(AlignmentStore('{}.bin'.format(prefix), self.size))
             except Exception, e:
-                print ("Failed to open document: {}/{}.align... {}".format(
-                    self.currDir, self.fileNames[fileiIdx], e))
-
+                print ("Failed to open document: {}.bin... {}".format(prefix, e))
+                stores.append(None)
+        empty = alignstore.EMPTY
+        A = [[empty if store is None else store[lineIdx] for store in stores]
+             for lineIdx in xrange(self.size)]
         return A
             
     def read(self, fileiIdx):
         # expects a file index
         return self.fileList[self.perm[fileiIdx]].read().split("\n")
+
+    def readAll(self):
+        # every line of every file, in file order; leaves the files rewound
+        for f in self.fileList:
+            f.seek(0)
+            for line in f.read().split("\n")[:self.size]:
+                yield line
+            f.seek(0)
         
+    def partners(self, fileiIdx):
+        """
+        Earlier files that fileiIdx is aligned to directly: all of them, or
+        only the pivots (the first self.pivots files of the permutation)
+        """
+        if (self.pivots > 0):
+            return xrange(min(fileiIdx, self.pivots))
+        return xrange(fileiIdx)
+
+    def openStore(self, fileiIdx, filejIdx):
+        # the store of a pair aligned this iteration, empty if it is missing
+        try:
+            if (self.scheduler is not None):
+                self.scheduler.wait((fileiIdx, filejIdx))
+            return AlignmentStore('{}/{}/{}.bin'.format(
+                self.currDir, 
+                self.fileNames[self.perm[fileiIdx]], 
+                self.fileNames[self.perm[filejIdx]]), self.size, dropLowQuality=True)
+        except Exception, e:
+            print ("Failed to open document: {}, {} -> {}, {}".format(filejIdx, fileiIdx, 
+                                                            self.perm[filejIdx], self.perm[fileiIdx]))
+            print ("Did not open {}/{}/{}.bin".format(
+                self.currDir, 
+                self.fileNames[self.perm[fileiIdx]], 
+                self.fileNames[self.perm[filejIdx]]))
+            print (e)
+            # Alignments don't exist. Oh well, we saved memory and time.
+            return [alignstore.EMPTY for _ in xrange(self.size)]
+
     def loadAlignments(self, fileiIdx):
         """
         returns a massive array with respect to fileiIdx with the following behavior:
         for filejIdx < fileiIdx
-        A[filejIdx] is the alignments in tmp/i/j.align and
+        A[filejIdx] is the alignment store of tmp/i/j.align and
         A[filejIdx][line] is the alignments ,a, at tmp/i/j.align:line
         where a[wordiIdx] = wordIdx list from j.align:line that aligned to a[wordiIdx]
+        Stores are memory mapped, lines are only unpacked when indexed.
+        With pivots, A[filejIdx] of a file that is not a partner goes i -> pivot -> j
+        through every pivot, see alignstore.ComposedAlignments.
         """
-        A = [[defaultdict(list) for i in xrange(self.size)] for j in xrange(fileiIdx)]
-        for filejIdx in xrange(fileiIdx):
-            try:
-                document = open('{}/{}/{}.align'.format(
-                    self.currDir, 
-                    self.fileNames[self.perm[fileiIdx]], 
-                    self.fileNames[self.perm[filejIdx]]), 'r').read().split("\n")
-                for lineIdx in xrange(self.size): #= len(document)
-                    line = document[lineIdx]
-                    if (len(line) > 0):
-                        pairs = map(lambda x: x.split("-"), line.strip().split(" "))
-                        if (lowQuality(pairs)):
-                            continue
-                        else:
-                            for pair in pairs:
-                                A[filejIdx][lineIdx][int(pair[0])].append(int(pair[1]))
-            except Exception, e:
-                print ("Failed to open document: {}, {} -> {}, {}".format(filejIdx, fileiIdx, 
-                                                                self.perm[filejIdx], self.perm[fileiIdx]))
-                print ("Did not open {}/{}/{}.align".format(
-                    self.currDir, 
-                    self.fileNames[self.perm[fileiIdx]], 
-                    self.fileNames[self.perm[filejIdx]]))
-                print (e)
-                # Alignments don't exist. Oh well, we saved memory and time.
-                pass
-
+        A = [self.openStore(fileiIdx, filejIdx) for filejIdx in self.partners(fileiIdx)]
+        pivots = range(len(A))
+        for filejIdx in xrange(len(A), fileiIdx):
+            A.append(ComposedAlignments(
+                [(A[pivot], self.openStore(filejIdx, pivot)) for pivot in pivots]))
         return A
 
-    def writeProgress(self, inferers, rules, t0):
-        name = "alignments.log"
-        name2 = "predicates.log"
+    def openLog(self, name):
+        """
+        Buffered utf-8 writer of currDir/name, or of currDir/name.gz
+        returns (path, writer)
+        """
         path = "{}/{}".format(self.currDir, name)
-        path2 = "{}/{}".format(self.currDir, name2)
-        output = codecs.open(path, 'w', "utf-8")
-        output2 = codecs.open(path2, 'w', "utf-8")
-        for (inferer, rule) in zip(inferers, rules):
-            infererString, relationsString = inferer.toString()
-            output.write(u"{}\nAlignments:\n{}\n\nRules:\n{}\nScore:{}\n".format(    
-                 "-" * 50,
-                 infererString,
-                 str(rule),
-                 inferer.getScore()
-             ))
-            output2.write(u"{}\n{}\n".format(
-                "-" * 50,
-                relationsString)
-            )
+        if (self.compressLogs):
+            path = "{}.gz".format(path)
+            stream = io.BufferedWriter(gzip.open(path, 'wb'), LOG_BUFFER)
+        else:
+            stream = io.open(path, 'wb', buffering=LOG_BUFFER)
+        return (path, codecs.getwriter("utf-8")(stream))
+
+    def writeProgress(self, inferers, rules, t0, full=True):
+        """
+        Write alignments.log, predicates.log and predicates.jsonl. Every
+        inferer is streamed to the logs, see Inferer.writeTo. Without full,
+        only the score reports of alignments.log are written.
+        returns the path of alignments.log
+        """
+        (path, output) = self.openLog("alignments.log")
+        if (full):
+            (_, output2) = self.openLog("predicates.log")
+            # predicates.log as JSON, a line per inferer, see Relation.toRecord
+            (_, output3) = self.openLog(PREDICATES)
+            for (row, (inferer, rule)) in enumerate(zip(inferers, rules)):
+                output.write(u"{}\nAlignments:\n".format("-" * 50))
+                output2.write(u"{}\n".format("-" * 50))
+                inferer.writeTo(output.write, output2.write)
+                output.write(u"\n\nRules:\n")
+                writeRules(output.write, rule)
+                output.write(u"\nScore:{}\n".format(inferer.getScore()))
+                output2.write(u"\n")
+                output3.write(u"{}\n".format(json.dumps(
+                    {"row": row, "predicates": inferer.predicates()}, ensure_ascii=False)))
+            output2.close()
+            output3.close()
         output.write(u"Score reports\n")
         for inferer in inferers:
             output.write(u"{}\n".format(inferer.getScore()))
@@ -272,109 +395,89 @@ class Aligner:
         t1 = time.time()
         output.write(u"Approx. Time: {}\n".format(t1-t0))
         output.close()
-        output2.close()
         return path
 
-    def writePairAlignments(self, inferers):
-        alignDir = "{}/pair_alignments".format(self.currDir)
-        print ("Writing pair alignments")
-        try:
-            os.mkdir(alignDir)
-        except Exception, e:
-            #?
-            print (e)
-            pass
-        for i in xrange(self.numFiles):
-            for j in xrange(i):
-                outAlignsFile = "{}/{}-{}.align".format(alignDir, i, j)
-                outAligns = codecs.open(outAlignsFile, 'w', "utf-8")
-                for inferer in inferers:
-                    aligns = []
-                    for r in inferer.relations:
-                        if (inferer.invperm[i] in r.structures and
-                            inferer.invperm[j] in r.structures):
-                            aligns.append("{}-{}".format(
-                                r.structures[inferer.invperm[i]].name.i,
-                                r.structures[inferer.invperm[j]].name.i))
-                    outAligns.write("{}\n".format(" ".join(aligns)))
-                outAligns.close()
-
-    def writeCommonAlignments(self, inferers):
-        alignDir = "{}/alignments".format(self.currDir)
-        print ("Writing alignments")
-        try:
-            os.mkdir(alignDir)
-        except Exception, e:
-            #?
-            print (e)
-            pass
-        # write common alignment key
-        common = []
-        for inferer in inferers:
-            current = []
-            for relation in inferer.relations:
-                current.append(relation.finalString())
-            common.append(" ".join(current))
-        outCommonFile = "{}/common.key".format(alignDir)
-        outCommon = codecs.open(outCommonFile, 'w', "utf-8")
-        outCommon.write("\n".join(common))
-        outCommon.close()
-
-        # write alignments w.r.t. common
-        for i in xrange(self.numFiles):
-            outAlignsFile = "{}/{}.align".format(alignDir, i)
-            outAligns = codecs.open(outAlignsFile, 'w', "utf-8")
-            for inferer in inferers:
-                aligns = []
-                for c, r in enumerate(inferer.relations):
-                    if (inferer.invperm[i] in r.structures):
-                        aligns.append("{}-{}".format(
-                            r.structures[inferer.invperm[i]].name.i,
-                            c))
-                outAligns.write("{}\n".format(" ".join(aligns)))
-            outAligns.close()
-
-    # write POS
-    def writePOSHeads(self, inferers):
-        posDir = "{}/pos".format(self.currDir)
-        headDir = "{}/heads".format(self.currDir)
-        wordDir = "{}/words".format(self.currDir)
-        print ("Writing POS and heads")
+    def outputDir(self, name):
+        path = "{}/{}".format(self.currDir, name)
         try:
-            os.mkdir(posDir)
-            os.mkdir(headDir)
-            os.mkdir(wordDir)
+            os.mkdir(path)
         except Exception, e:
             #?
             print (e)
             pass
+        return path
+
+    def writeOutputs(self, inferers):
+        # text outputs, columnar outputs or both, as outputFormat says
+        if (self.outputFormat != "columnar"):
+            self.writeText(inferers)
+        if (self.outputFormat != "text"):
+            print ("Writing {}".format(columnar.OUTPUT))
+            columnar.write("{}/{}".format(self.currDir, columnar.OUTPUT), inferers, self.fileNames)
+
+    def writeText(self, inferers):
+        """
+        Writes, one line per inferer:
+        pair_alignments/i-j.align       token i-token j of the relations
+                                        edition i and j (i > j) share
+        alignments/common.key           consensus string of each relation
+        alignments/i.align              token-relation of edition i
+        pos/, heads/, words/            tag, head and word of the tokens of
+                                        each edition in a relation
+        Each inferer is read once, into a table of relation members by file,
+        and the lines of WRITE_ROWS inferers are appended to every file at a
+        time.
+        """
+        print ("Writing alignments, POS and heads")
+        pairDir = self.outputDir("pair_alignments")
+        alignDir = self.outputDir("alignments")
+        (posDir, headDir, wordDir) = [self.outputDir(name) for name in ["pos", "heads", "words"]]
+        pairs = [(i, j) for i in xrange(self.numFiles) for j in xrange(i)]
+        pairPaths = dict(((i, j), "{}/{}-{}.align".format(pairDir, i, j)) for (i, j) in pairs)
+        commonPath = "{}/common.key".format(alignDir)
+        alignPaths = ["{}/{}.align".format(alignDir, i) for i in xrange(self.numFiles)]
+        posPaths = ["{}/{}.pos".format(posDir, f) for f in self.fileNames]
+        headPaths = ["{}/{}.head".format(headDir, f) for f in self.fileNames]
+        wordPaths = ["{}/{}.words".format(wordDir, f) for f in self.fileNames]
+        paths = ([pairPaths[pair] for pair in pairs] + [commonPath] + alignPaths +
+                 posPaths + headPaths + wordPaths)
+        for path in paths:
+            codecs.open(path, 'w', "utf-8").close()
 
-        for i,f in enumerate(self.fileNames):
-            outPosFile = "{}/{}.pos".format(posDir, f)
-            outHeadFile = "{}/{}.head".format(headDir, f)
-            outWordFile = "{}/{}.words".format(wordDir, f)
-            outPos = codecs.open(outPosFile, 'w', "utf-8")
-            outHead = codecs.open(outHeadFile, 'w', "utf-8")
-            outWords = codecs.open(outWordFile, 'w', "utf-8")
-
-            for inferer in inferers:
-                tags = {}
-                heads = {}
-                words = {}
-                for r in inferer.relations:
-                    if (inferer.invperm[i] in r.structures):
-                        structName = r.structures[inferer.invperm[i]].name
-                        structIndex = structName.i
-                        tags[structIndex] = str(structName.tag_)
-                        heads[structIndex] = str(structName.head.i)
-                        words[structIndex] = str(structName)
-                # this feels unsafe
-                outPos.write(u"{}\n".format(u" ".join(tags.values())))
-                outHead.write(u"{}\n".format(u" ".join(heads.values())))
-                try:
-                    outWords.write(u"{}\n".format(u" ".join(words.values())))
-                except:
-                    outWords.write(u"{}\n".format("----DND----"))
-            outPos.close()
-            outHead.close()
-            outWords.close()
+        for start in xrange(0, len(inferers), WRITE_ROWS):
+            lines = defaultdict(list)
+            for (row, inferer) in enumerate(inferers[start:start + WRITE_ROWS], start):
+                pairAligns = defaultdict(list)
+                aligns = [[] for _ in xrange(self.numFiles)]
+                # filled in relation order, like the separate writers did
+                tags = [{} for _ in xrange(self.numFiles)]
+                heads = [{} for _ in xrange(self.numFiles)]
+                words = [{} for _ in xrange(self.numFiles)]
+                common = []
+                for (c, r) in enumerate(inferer.relations):
+                    common.append(r.finalString())
+                    members = sorted([(inferer.perm[ed], structure)
+                                      for (ed, structure) in r.structures.items()])
+                    for (k, (i, structure)) in enumerate(members):
+                        for (j, other) in members[:k]:
+                            pairAligns[(i, j)].append("{}-{}".format(structure.i, other.i))
+                        aligns[i].append("{}-{}".format(structure.i, c))
+                        tags[i][structure.i] = str(structure.tag())
+                        heads[i][structure.i] = str(structure.head())
+                        words[i][structure.i] = str(structure)
+                for pair in pairs:
+                    lines[pairPaths[pair]].append("{}\n".format(" ".join(pairAligns[pair])))
+                # common.key has no trailing newline
+                lines[commonPath].append("{}{}".format("\n" if row > 0 else "", " ".join(common)))
+                for i in xrange(self.numFiles):
+                    lines[alignPaths[i]].append("{}\n".format(" ".join(aligns[i])))
+                    # this feels unsafe
+                    lines[posPaths[i]].append(u"{}\n".format(u" ".join(tags[i].values())))
+                    lines[headPaths[i]].append(u"{}\n".format(u" ".join(heads[i].values())))
+                    try:
+                        lines[wordPaths[i]].append(u"{}\n".format(u" ".join(words[i].values())))
+                    except:
+                        lines[wordPaths[i]].append(u"{}\n".format("----DND----"))
+            for path in paths:
+                with codecs.open(path, 'a', "utf-8") as output:
+                    output.write(u"".join(lines[path]))
@@ -0,0 +1,181 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Binary pairwise alignments. A store holds the alignments of one pair of
+# files in CSR layout:
+#   header | offsets (int64, numLines + 1) | sources | targets
+# where line l owns sources/targets[offsets[l]:offsets[l+1]]. Indices are
+# int16 when every index fits, int32 otherwise.
+
+import struct
+import numpy as np
+
+from itertools import izip
+
+# magic, bytes per index, number of lines, number of pairs
+HEADER = struct.Struct(b"<4sB3xII")
+MAGIC = b"MLAS"
+
+def writeArrays(storePath, offsets, sources, targets):
+    """
+    offsets: int array     Line l is sources/targets[offsets[l]:offsets[l+1]]
+    sources, targets: int arrays of the same length
+    """
+    dtype = np.int16
+    if (len(sources) > 0 and max(sources.max(), targets.max()) > np.iinfo(np.int16).max):
+        dtype = np.int32
+    with open(storePath, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, np.dtype(dtype).itemsize, len(offsets) - 1, len(sources)))
+        f.write(np.asarray(offsets, dtype=np.int64).tostring())
+        f.write(np.asarray(sources).astype(dtype).tostring())
+        f.write(np.asarray(targets).astype(dtype).tostring())
+
+def write(lines, storePath):
+    """
+    lines: string list     Aligner output, "i-j i-j ..." per line
+    """
+    counts = [line.count("-") for line in lines]
+    values = np.array(" ".join(lines).replace("-", " ").split(), dtype=np.int64)
+    pairs = values.reshape(-1, 2)
+    offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    writeArrays(storePath, offsets, pairs[:, 0], pairs[:, 1])
+
+def convert(alignPath, storePath):
+    # store the text output of an aligner run
+    with open(alignPath, 'r') as f:
+        lines = f.read().split("\n")
+    if (len(lines) > 0 and len(lines[-1]) == 0):
+        # trailing newline
+        lines.pop()
+    write(lines, storePath)
+
+class LineAlignments(object):
+    """
+    Alignments of one line, answers view[i] with the list of target indices
+    aligned to source index i (empty if none), like the defaultdict(list)
+    it replaces. The lookup table is only built on first use.
+    """
+    __slots__ = ("sources", "targets", "lookup")
+
+    def __init__(self, sources, targets):
+        self.sources = sources
+        self.targets = targets
+        self.lookup = None
+
+    def table(self):
+        if (self.lookup is None):
+            lookup = {}
+            for (i, j) in izip(self.sources.tolist(), self.targets.tolist()):
+                lookup.setdefault(i, []).append(j)
+            self.lookup = lookup
+        return self.lookup
+
+    def __getitem__(self, i):
+        return self.table().get(i, [])
+
+    def __len__(self):
+        return len(self.table())
+
+    # only the lookup table is sent to other processes
+    def __getstate__(self):
+        return self.table()
+
+    def __setstate__(self, lookup):
+        self.sources = None
+        self.targets = None
+        self.lookup = lookup
+
+    @classmethod
+    def fromTable(cls, lookup):
+        alignments = cls(None, None)
+        alignments.lookup = lookup
+        return alignments
+
+EMPTY = LineAlignments(np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16))
+
+class AlignmentStore:
+    """
+    Memory mapped store of one pair, store[line] is a LineAlignments
+    numLines : int          Number of lines visible, lines past the end of
+                            the store are empty
+    skip : bool array       Lines dropped by lowQuality
+    """
+    def __init__(self, storePath, numLines, dropLowQuality=False):
+        data = np.memmap(storePath, dtype=np.uint8, mode='r')
+        (magic, itemsize, storedLines, numPairs) = HEADER.unpack(data[:HEADER.size].tostring())
+        if (magic != MAGIC):
+            raise IOError("Not an alignment store: {}".format(storePath))
+        dtype = np.int16 if itemsize == 2 else np.int32
+        start = HEADER.size
+        end = start + 8 * (storedLines + 1)
+        self.offsets = data[start:end].view(np.int64)
+        self.sources = data[end:end + itemsize * numPairs].view(dtype)
+        self.targets = data[end + itemsize * numPairs:end + 2 * itemsize * numPairs].view(dtype)
+        self.numLines = numLines
+        self.storedLines = storedLines
+        self.skip = np.zeros(storedLines, dtype=bool)
+        if (dropLowQuality):
+            self.skip = self.lowQuality()
+
+    def lowQuality(self):
+        # vectorized aligner.lowQuality: all sources or all targets are 0
+        skip = np.zeros(self.storedLines, dtype=bool)
+        starts = self.offsets[:-1]
+        nonEmpty = np.nonzero(self.offsets[1:] > starts)[0]
+        if (len(nonEmpty) == 0):
+            return skip
+        # segments run up to the next non-empty line, empty lines add nothing
+        sourceSums = np.add.reduceat(self.sources.astype(np.int64), starts[nonEmpty])
+        targetSums = np.add.reduceat(self.targets.astype(np.int64), starts[nonEmpty])
+        skip[nonEmpty] = (sourceSums == 0) | (targetSums == 0)
+        return skip
+
+    def __getitem__(self, line):
+        if (line >= self.storedLines or self.skip[line]):
+            return EMPTY
+        (lo, hi) = (self.offsets[line], self.offsets[line + 1])
+        return LineAlignments(self.sources[lo:hi], self.targets[lo:hi])
+
+    def __len__(self):
+        return self.numLines
+
+class ComposedAlignments:
+    """
+    Alignments i -> j derived through pivots: token a of i is aligned to
+    token b of j if some pivot token is aligned to both. Unions over the
+    pivots, built line by line when indexed.
+    pivots : (store, store) list    (i -> pivot, j -> pivot) per pivot
+    """
+    def __init__(self, pivots):
+        self.pivots = pivots
+
+    def __getitem__(self, line):
+        lookup = {}
+        for (toPivot, fromPivot) in self.pivots:
+            inverse = {}
+            for (b, cs) in fromPivot[line].table().items():
+                for c in cs:
+                    inverse.setdefault(c, set()).add(b)
+            for (a, cs) in toPivot[line].table().items():
+                for c in cs:
+                    if c in inverse:
+                        lookup.setdefault(a, set()).update(inverse[c])
+        return LineAlignments.fromTable(dict((a, sorted(bs)) for (a, bs) in lookup.items()))
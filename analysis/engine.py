@@ -0,0 +1,430 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# One pass over the text outputs of an iteration for every analysis of this
+# directory. The output files are line-parallel, so a shard opens the files
+# its accumulators need and reads them in lockstep, a row at a time; every
+# accumulator sees every row once. Accumulators merge, so shards (blocks of
+# editions and edition pairs) can run in separate processes and partial
+# results can be saved and combined later.
+#
+# python analysis/engine.py ITERATION_DIR DATA_DIR --workers 4 --output OUT
+#   ITERATION_DIR   an iteration directory of a run (words/, pos/, ...)
+#   DATA_DIR        the data directory of the run, for the edition order
+
+import argparse
+import cPickle
+import gzip
+import io
+import itertools
+import multiprocessing
+import os
+import sys
+
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pred
+
+SEPARATOR = "-" * 50
+
+class Row:
+    """
+    Line `index` of every file a shard reads, split on first use
+    common : string list            Consensus string of each relation
+    predicates : (string, string)   Predicates of the row, ("jsonl", line of
+                                    predicates.jsonl) or ("log", block of
+                                    predicates.log)
+    """
+    def __init__(self, index, lines, common, predicates):
+        self.index = index
+        self.lines = lines
+        self.common = common
+        self.predicates = predicates
+        self.cache = {}
+
+    def line(self, kind, key):
+        return self.lines[(kind, key)]
+
+    def split(self, kind, key):
+        if (kind, key) not in self.cache:
+            self.cache[(kind, key)] = self.lines[(kind, key)].split()
+        return self.cache[(kind, key)]
+
+    def pairs(self, kind, key):
+        # "a-b a-b" lines as int pairs
+        return [tuple(int(x) for x in pair.split("-")) for pair in self.split(kind, key)]
+
+def histogramLines(counts):
+    # key: value: share value: share ..., like the single scripts printed
+    lines = []
+    for (key, hist) in counts.items():
+        total = float(sum(hist.values()))
+        values = sorted(hist.items(), key=lambda (k, v): (-v, k))
+        lines.append("{}: {}".format(key, " ".join(["{}: {}".format(k, v / total)
+                                                     for (k, v) in values])))
+    return sorted(lines)
+
+class Accumulator(object):
+    """
+    A histogram of key -> value -> count over the rows of a run
+    name : string       Name of the report
+    files : string list Kinds of per-edition files used: words, pos, heads, align
+    common : bool       Whether common.key is used
+    perPair : bool      Called with edition pairs (pair_alignments) instead of editions
+    """
+    files = ()
+    common = False
+    perPair = False
+    predicates = False
+
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+
+    def merge(self, other):
+        for (key, hist) in other.counts.items():
+            self.counts[key].update(hist)
+
+    def report(self):
+        return histogramLines(self.counts)
+
+def skipped(sentence):
+    return ("DND" in sentence or sentence == "")
+
+class WordPOS(Accumulator):
+    # word -> tag, freq.py
+    name = "word-pos"
+    files = ("words", "pos")
+
+    def add(self, row, i):
+        if skipped(row.line("words", i)):
+            return
+        words = row.line("words", i).strip().split(" ")
+        for (word, tag) in zip(words, row.line("pos", i).strip().split(" ")):
+            self.counts[word][tag] += 1
+
+class WordHead(Accumulator):
+    # word -> word of its head, freq.py
+    name = "word-head"
+    files = ("words", "heads")
+
+    def add(self, row, i):
+        if skipped(row.line("words", i)):
+            return
+        words = row.line("words", i).strip().split(" ")
+        for (word, head) in zip(words, row.line("heads", i).strip().split(" ")):
+            try:
+                self.counts[word][words[int(head)]] += 1
+            except (ValueError, IndexError):
+                continue
+
+class CommonPOS(Accumulator):
+    # consensus string -> tag of the tokens in its relation, POS.py
+    name = "common-pos"
+    files = ("align", "pos")
+    common = True
+
+    def add(self, row, i):
+        tags = row.split("pos", i)
+        for (token, c) in row.pairs("align", i):
+            try:
+                self.counts[row.common[c]][tags[token]] += 1
+            except IndexError:
+                continue
+
+class CommonHead(Accumulator):
+    # consensus string -> consensus string of the head's relation, HEAD.py
+    name = "common-head"
+    files = ("align", "heads")
+    common = True
+
+    def add(self, row, i):
+        heads = row.split("heads", i)
+        aligns = row.pairs("align", i)
+        relationOf = dict(aligns)
+        for (token, c) in aligns:
+            try:
+                self.counts[row.common[c]][row.common[relationOf[int(heads[token])]]] += 1
+            except (KeyError, IndexError, ValueError):
+                continue
+
+class Paraphrase(Accumulator):
+    # consensus string -> words of an edition aligned to it, pp.py
+    name = "paraphrase"
+    files = ("words", "align")
+    common = True
+
+    def add(self, row, i):
+        if skipped(row.line("words", i)):
+            return
+        sentence = row.line("words", i).strip().split(" ")
+        wordset = defaultdict(list)
+        commonword = None
+        for (first, second) in row.pairs("align", i):
+            commonword = row.common[second]
+            sentword = sentence[first]
+            if commonword in wordset:
+                if wordset[commonword][-1] == sentword:
+                    continue
+            wordset[commonword].append(sentword)
+        # like pp.py, only the last relation of the line is counted
+        if (commonword is not None):
+            self.counts[commonword][" ".join(wordset[commonword])] += 1
+
+class PairParaphrase(Accumulator):
+    # word -> words of another edition aligned to it, pp2.py
+    name = "pair-paraphrase"
+    files = ("words",)
+    perPair = True
+
+    def add(self, row, (i, j)):
+        sent1 = row.line("words", i)
+        sent2 = row.line("words", j)
+        if (skipped(sent1) or skipped(sent2)):
+            return
+        sentence = sent1.strip().split(" ")
+        sentence2 = sent2.strip().split(" ")
+        word1set = defaultdict(list)
+        word2set = defaultdict(list)
+        for (first, second) in row.pairs("pair", (i, j)):
+            sent2word = sentence2[second]
+            sent1word = sentence[first]
+            if sent2word in word2set:
+                if word2set[sent2word][-1] == sent1word:
+                    continue
+            word2set[sent2word].append(sent1word)
+            if sent1word in word1set:
+                if word1set[sent1word][-1] == sent2word:
+                    continue
+            word1set[sent1word].append(sent2word)
+        for word1 in sentence:
+            if len(word1set[word1]) > 0:
+                self.counts[word1][" ".join(word1set[word1])] += 1
+        for word2 in sentence2:
+            if len(word2set[word2]) > 0:
+                self.counts[word2][" ".join(word2set[word2])] += 1
+
+class PredicateFrames(Accumulator):
+    # verb frames of each row, pred.py
+    name = "predicates"
+    predicates = True
+
+    def __init__(self):
+        self.frames = {}
+
+    def add(self, row, _):
+        (kind, text) = row.predicates
+        if (kind == "jsonl"):
+            collapsed = pred.collapse_records(pred.read_records(text)[1])
+        else:
+            collapsed = pred.collapse(pred.read_block(text.encode("utf-8")))
+        if len(collapsed) != 0:
+            self.frames[row.index] = [str(frame).decode("utf-8") for frame in collapsed]
+
+    def merge(self, other):
+        self.frames.update(other.frames)
+
+    def report(self):
+        lines = []
+        for index in sorted(self.frames):
+            lines.append("{}".format(index))
+            lines.extend(self.frames[index])
+        return lines
+
+ACCUMULATORS = [WordPOS, WordHead, CommonPOS, CommonHead, Paraphrase, PairParaphrase,
+                PredicateFrames]
+
+def path(runDir, fileNames, kind, key):
+    if (kind == "pair"):
+        return "{}/pair_alignments/{}-{}.align".format(runDir, key[0], key[1])
+    if (kind == "align"):
+        return "{}/alignments/{}.align".format(runDir, key)
+    suffix = {"words": "words", "pos": "pos", "heads": "head"}[kind]
+    return "{}/{}/{}.{}".format(runDir, kind, fileNames[key], suffix)
+
+def readLines(fileName):
+    # only \n ends a line, words may hold other line breaks
+    if fileName.endswith(".gz"):
+        f = io.TextIOWrapper(io.BufferedReader(gzip.open(fileName, 'rb')),
+                             encoding="utf-8", newline="\n")
+    else:
+        f = io.open(fileName, 'r', encoding="utf-8", newline="\n")
+    with f:
+        for line in f:
+            yield line[:-1] if line.endswith("\n") else line
+
+def readBlocks(fileName):
+    # the predicates of each row, one block per row
+    block = None
+    for line in readLines(fileName):
+        if (line == SEPARATOR):
+            if (block is not None):
+                yield "\n".join(block)
+            block = []
+        elif (block is not None):
+            block.append(line)
+    if (block is not None):
+        yield "\n".join(block)
+
+def logPath(runDir, name):
+    # the log, or its gzipped copy (--gzip-logs)
+    fileName = "{}/{}".format(runDir, name)
+    if not os.path.exists(fileName) and os.path.exists("{}.gz".format(fileName)):
+        return "{}.gz".format(fileName)
+    return fileName
+
+def readPredicates(runDir):
+    # predicates.jsonl, predicates.log for runs that have none
+    fileName = logPath(runDir, "predicates.jsonl")
+    if os.path.exists(fileName):
+        return itertools.izip(itertools.repeat("jsonl"), readLines(fileName))
+    return itertools.izip(itertools.repeat("log"),
+                          readBlocks(logPath(runDir, "predicates.log")))
+
+def runShard(runDir, fileNames, names, editions, pairs, predicates):
+    """
+    Feed the rows of the files needed for editions and pairs, and the
+    predicates if predicates, to a new accumulator of each name.
+    returns the accumulators
+    """
+    accumulators = [accumulator() for accumulator in ACCUMULATORS
+                    if accumulator.name in names and (predicates or not accumulator.predicates)]
+    keys = set()
+    for accumulator in accumulators:
+        units = pairs if accumulator.perPair else editions
+        for unit in units:
+            for kind in accumulator.files:
+                for key in (unit if accumulator.perPair else [unit]):
+                    keys.add((kind, key))
+            if accumulator.perPair:
+                keys.add(("pair", unit))
+    keys = sorted(keys)
+    streams = [readLines(path(runDir, fileNames, kind, key)) for (kind, key) in keys]
+    if any([accumulator.common for accumulator in accumulators]):
+        streams.append(readLines("{}/alignments/common.key".format(runDir)))
+    else:
+        streams.append(itertools.repeat(""))
+    if any([accumulator.predicates for accumulator in accumulators]):
+        streams.append(readPredicates(runDir))
+    else:
+        streams.append(itertools.repeat(""))
+    if (len(keys) == 0 and not any([a.common or a.predicates for a in accumulators])):
+        # nothing to read
+        return accumulators
+    for (index, lines) in enumerate(itertools.izip(*streams)):
+        row = Row(index, dict(zip(keys, lines[:len(keys)])), lines[-2].strip().split(" "),
+                  lines[-1])
+        for accumulator in accumulators:
+            if accumulator.predicates:
+                accumulator.add(row, None)
+                continue
+            for unit in (pairs if accumulator.perPair else editions):
+                accumulator.add(row, unit)
+    return accumulators
+
+def runShardArgs(args):
+    return runShard(*args)
+
+def shards(numFiles, workers):
+    """
+    Split the editions and the pairs (i, j), j < i, into workers blocks,
+    returns (editions, pairs, predicates) per block. The first block reads
+    the predicates.
+    """
+    editions = range(numFiles)
+    pairs = [(i, j) for i in xrange(numFiles) for j in xrange(i)]
+    return [(editions[k::workers], pairs[k::workers], k == 0) for k in xrange(workers)]
+
+def analyze(runDir, fileNames, names, workers=1):
+    """
+    returns name -> merged accumulator
+    """
+    work = [(runDir, fileNames, names, editions, pairs, predicates)
+            for (editions, pairs, predicates) in shards(len(fileNames), workers)]
+    if (workers > 1):
+        pool = multiprocessing.Pool(workers)
+        try:
+            parts = pool.map(runShardArgs, work)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parts = [runShardArgs(args) for args in work]
+    return mergeParts(parts)
+
+def mergeParts(parts):
+    merged = {}
+    for part in parts:
+        for accumulator in part:
+            if accumulator.name in merged:
+                merged[accumulator.name].merge(accumulator)
+            else:
+                merged[accumulator.name] = accumulator
+    return merged
+
+def editionOrder(dataDir):
+    # the order of the Aligner, hence of the file indices of the outputs
+    return [f for f in os.listdir(dataDir) if f.endswith(".txt")]
+
+if __name__ == "__main__":
+    names = [accumulator.name for accumulator in ACCUMULATORS]
+    argparser = argparse.ArgumentParser(description="Analyses of a monolign iteration directory")
+    argparser.add_argument("run_dir", nargs="?", help="iteration directory of a run")
+    argparser.add_argument("data_dir", nargs="?", help="data directory of the run")
+    argparser.add_argument("--analyses", nargs="+", choices=names, default=names)
+    argparser.add_argument("--workers", type=int, default=1,
+                           help="processes, each reading a block of editions and pairs")
+    argparser.add_argument("--output", default=None, metavar="DIR",
+                           help="write each report to DIR/<analysis>.txt instead of stdout")
+    argparser.add_argument("--partial", default=None, metavar="FILE",
+                           help="save the accumulators to FILE instead of reporting")
+    argparser.add_argument("--merge", nargs="+", default=None, metavar="FILE",
+                           help="report on saved accumulators instead of a run")
+    args = argparser.parse_args()
+
+    if (args.merge is not None):
+        parts = []
+        for fileName in args.merge:
+            with open(fileName, 'rb') as f:
+                parts.append(cPickle.load(f).values())
+        merged = mergeParts(parts)
+    else:
+        if (args.run_dir is None or args.data_dir is None):
+            argparser.error("run_dir and data_dir are needed without --merge")
+        merged = analyze(args.run_dir, editionOrder(args.data_dir), args.analyses, args.workers)
+    if (args.partial is not None):
+        with open(args.partial, 'wb') as f:
+            cPickle.dump(merged, f, 2)
+        sys.exit(0)
+    if (args.output is not None and not os.path.isdir(args.output)):
+        os.mkdir(args.output)
+    for name in names:
+        if name not in merged:
+            continue
+        lines = merged[name].report()
+        if (args.output is not None):
+            with io.open(os.path.join(args.output, "{}.txt".format(name)), 'w',
+                         encoding="utf-8") as f:
+                f.write("".join(["{}\n".format(line) for line in lines]))
+        else:
+            print ("# {}".format(name))
+            for line in lines:
+                print (line.encode("utf-8"))
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import gzip
+import json
 import sys
 
 def POSify(triple_set):
@@ -78,30 +80,102 @@ def collapse(d_list):
 
     return preds
 
+def arg_words(record):
+    # POSify for a record of predicates.jsonl, the words keep their relation ids
+    return {arg["edge"]: (arg["string"], u"{:.2f}".format(arg["weight"]), arg["target"])
+            for arg in record["args"]}
+
+class RecordPredicate(Predicate):
+    # a verb of predicates.jsonl, read like a verb of predicates.log
+    def __init__(self, record):
+        self.predicate = record["string"].encode("utf-8")
+        self.words = arg_words(record)
+        args = {edge: word[:2] for (edge, word) in self.words.items()}
+        self.nsubj = args.get('nsubj')
+        self.dobj = args.get('dobj')
+        self.prep = args.get('prep')
+        self.comp = args.get('xcomp')
+
+def expand_id(word, by_id, ancestors):
+    # expand on relation ids instead of strings, a relation is not expanded
+    # again inside itself, so cycles end
+    if word == None:
+        return []
+    (string, weight, rid) = word
+    current = [(string, weight)]
+    if rid in ancestors or rid not in by_id:
+        return current
+    for new_word in arg_words(by_id[rid]).values():
+        current.append(expand_id(new_word, by_id, ancestors | set([rid])))
+    return current
+
+def collapse_records(records):
+    # collapse for the records of a line of predicates.jsonl
+    by_id = dict((record["id"], record) for record in records)
+    preds = []
+    for record in records:
+        if record["pos"] != 'VERB':
+            continue
+        verb_p = RecordPredicate(record)
+        ancestors = set([record["id"]])
+        verb_p.nsubj_list = expand_id(verb_p.words.get('nsubj'), by_id, ancestors)
+        verb_p.dobj_list = expand_id(verb_p.words.get('dobj'), by_id, ancestors)
+        verb_p.prep_list = expand_id(verb_p.words.get('prep'), by_id, ancestors)
+        verb_p.comp_list = expand_id(verb_p.words.get('xcomp'), by_id, ancestors)
+        preds.append(verb_p)
+    return preds
+
+def read_records(line):
+    entry = json.loads(line)
+    return (entry["row"], entry["predicates"])
+
+def open_log(f):
+    # logs may be gzipped (--gzip-logs)
+    if f.endswith(".gz"):
+        return gzip.open(f, 'rb')
+    return open(f, 'r')
+
+def read_jsonl(f):
+    # (row, records) per line of predicates.jsonl
+    for line in open_log(f):
+        if line.strip() == "":
+            continue
+        yield read_records(line)
+
+def read_block(block):
+    # the predicates of one inferer, as written to predicates.log
+    block_list = []
+    for b in block.split("\n"):
+        if b == "":
+            continue
+        try:
+            block_list.append(eval(b))
+        except:
+            b = b.replace("':", '":').replace(" '", ' "')
+            try:
+                block_list.append(eval(b))
+            except:
+                print "Error: {}".format(b, block, len(block))
+    return block_list
+
 def read_d_list(f):
-    text = open(f, 'r').read().split("-" * 50)
+    text = open_log(f).read().split("-" * 50)
     result = []
     for block in text:
-        block_list = []
         if len(block) == 0:
             result.append("")
             continue
-        for b in block.split("\n"):
-            if b == "":
-                continue
-            try:
-                block_list.append(eval(b))
-            except:
-                b = b.replace("':", '":').replace(" '", ' "')
-                try:
-                    block_list.append(eval(b))
-                except:
-                    print "Error: {}".format(b, block, len(block))
-        result.append(block_list)
+        result.append(read_block(block))
     return result
     
 
 if __name__ == "__main__":
+    if sys.argv[1].endswith(".jsonl") or sys.argv[1].endswith(".jsonl.gz"):
+        for (row, records) in read_jsonl(sys.argv[1]):
+            collapsed = collapse_records(records)
+            if len(collapsed) != 0:
+                print "{}\n{}".format(row, "\n".join(map(lambda x: str(x), collapsed)))
+        sys.exit(0)
     d_list_lists = read_d_list(sys.argv[1])
     for line_no, d_list in enumerate(d_list_lists):
         collapsed = collapse(d_list)
@@ -0,0 +1,263 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Pairwise aligners. A backend aligns the lines of two files, plus the rule
+# lines, and leaves an alignment store at outPrefix.bin for loadAlignments.
+# Backends are sent to scheduler workers, so they have to pickle.
+#
+# In train-once mode, parameters are trained the first time a pair is
+# aligned (or once up front on a pooled corpus) and kept in paramsDir;
+# every later alignment of the pair only decodes with them.
+
+import codecs
+import os
+
+import alignstore
+from model2 import Model2, Bitext
+
+# what the parameters of a directory were trained with, see Backend.flags
+FLAGS = "flags"
+
+def readLines(fileName):
+    # lines of a file as paste sees them
+    with codecs.open(fileName, 'r', "utf-8") as f:
+        lines = f.read().split("\n")
+    if (len(lines) > 0 and len(lines[-1]) == 0):
+        lines.pop()
+    return lines
+
+def trainedFlags(paramsDir):
+    """
+    returns the flags recorded in paramsDir by trainOnce, None if there are
+    none (nothing trained there yet, or trained before flags were recorded)
+    """
+    try:
+        with codecs.open(os.path.join(paramsDir, FLAGS), 'r', "utf-8") as f:
+            return f.read()
+    except IOError:
+        return None
+
+def pasteFiles(fileNames, bitextFile):
+    # "line ||| line" bitext of consecutive files, cycling back to the first
+    open(bitextFile, 'w').close()
+    for (k, fileName) in enumerate(fileNames):
+        os.system("paste {} {} | sed 's/\t/ ||| /' >> {} ".format(
+            fileName, fileNames[(k + 1) % len(fileNames)], bitextFile))
+
+class Backend(object):
+    """
+    Shared train-once bookkeeping
+    paramsDir : string      Where trained parameters are kept, None to
+                            retrain on every alignment
+    pooled : bool           One set of parameters for all pairs
+    """
+    paramsDir = None
+    pooled = False
+
+    def trainOnce(self, paramsDir, pooled, fileNames):
+        """
+        Keep parameters in paramsDir from now on. A pooled model is trained
+        right away on consecutive pairs of fileNames. Raises ValueError if
+        paramsDir holds parameters trained with other flags.
+        """
+        self.paramsDir = paramsDir
+        self.pooled = pooled
+        try:
+            os.mkdir(paramsDir)
+        except OSError:
+            # directory already exists
+            pass
+        trained = trainedFlags(paramsDir)
+        if (trained is not None and trained != self.flags()):
+            raise ValueError("{} holds aligner parameters trained with \"{}\", not \"{}\"".format(
+                paramsDir, trained, self.flags()))
+        if (trained is None):
+            with codecs.open(os.path.join(paramsDir, FLAGS), 'w', "utf-8") as f:
+                f.write(self.flags())
+        if (pooled and not os.path.exists(self.paramsPath(None, None))):
+            self.trainPooled(fileNames)
+
+    def flags(self):
+        # everything besides the bitext that changes the alignments
+        flags = self.settings()
+        if (self.paramsDir is not None):
+            flags += " train-once {}".format("pooled" if self.pooled else "pair")
+        return flags
+
+    def paramsPath(self, file1Name, file2Name):
+        if (self.pooled):
+            name = "pooled"
+        else:
+            name = "{}-{}".format(os.path.basename(file1Name), os.path.basename(file2Name))
+        return os.path.join(self.paramsDir, "{}.{}".format(name, self.suffix))
+
+class FastAlignBackend(Backend):
+    """
+    Runs the fast_align binary on a bitext written to tmpFile. Trained
+    parameters are fast_align's -p output, decoded with -f like its
+    force_align.py; rule lines can not be added then and are left out.
+    binary : string     Location of fast_align
+    """
+    name = "fast_align"
+    suffix = "params"
+
+    def __init__(self, binary):
+        self.binary = binary
+
+    def settings(self):
+        return "{} -d -o -v".format(self.binary)
+
+    def trainPooled(self, fileNames):
+        bitextFile = "{}.bitext".format(self.paramsPath(None, None))
+        pasteFiles(fileNames, bitextFile)
+        os.system("{} -i {} -d -o -v -p {} 1>/dev/null 2>{}.log".format(
+            self.binary, bitextFile, self.paramsPath(None, None), self.paramsPath(None, None)))
+
+    def trainedArgs(self, params):
+        # tension and length multiplier of the training run, from its log
+        (tension, multiplier) = ("4", "1")
+        with open("{}.log".format(params)) as log:
+            for line in log:
+                if "expected target length" in line:
+                    multiplier = line.split()[-1]
+                elif "final tension" in line:
+                    tension = line.split()[-1]
+        return (tension, multiplier)
+
+    def align(self, file1Name, file2Name, tmpFile, outPrefix, rules):
+        os.system("paste {} {} | sed 's/\t/ ||| /' > {} ".format(
+            file1Name,
+            file2Name,
+            tmpFile
+        ))
+        params = None
+        if (self.paramsDir is not None):
+            params = self.paramsPath(file1Name, file2Name)
+        if (params is not None and os.path.exists(params)):
+            (tension, multiplier) = self.trainedArgs(params)
+            os.system("{} -i {} -d -T {} -m {} -f {} 1>{}.align 2>{}.log".format(
+                self.binary, tmpFile, tension, multiplier, params, outPrefix, outPrefix))
+        else:
+            # add rules >>
+            with codecs.open(tmpFile, 'a', "utf-8") as tmpOpenFile:
+                tmpOpenFile.write(rules)
+
+            # experiment with alignment args.
+            output = "-p {}".format(params) if params is not None else ""
+            os.system("{} -i {} -d -o -v {} 1>{}.align 2>{}.log".format(
+                self.binary, tmpFile, output, outPrefix, outPrefix)
+            )
+            if (params is not None):
+                os.system("cp {}.log {}.log".format(outPrefix, params))
+        # parsed once here, loadAlignments maps the store
+        alignstore.convert("{}.align".format(outPrefix), "{}.bin".format(outPrefix))
+
+def linePairs(file1Name, file2Name):
+    # token lists of both files, line by line, like paste
+    lines1 = readLines(file1Name)
+    lines2 = readLines(file2Name)
+    numLines = max(len(lines1), len(lines2))
+    lines1 += [""] * (numLines - len(lines1))
+    lines2 += [""] * (numLines - len(lines2))
+    return [(a.split(), b.split()) for (a, b) in zip(lines1, lines2)]
+
+def rulePairs(rules):
+    pairs = []
+    for rule in rules.split("\n"):
+        (a, _, b) = rule.partition(" ||| ")
+        pairs.append((a.split(), b.split()))
+    return pairs
+
+class Model2Backend(Backend):
+    """
+    In-process equivalent of `fast_align -d -o -v`, see model2.py. Nothing
+    is written but the store and a short log; tmpFile is unused.
+    Trained parameters are trained without rule lines; when decoding, the
+    expected counts of the current rule lines are added to them.
+    options : dict      Keyword arguments of Model2
+    pooledModel : Model2    Pooled parameters once loaded, None before
+    """
+    name = "model2"
+    suffix = "npz"
+
+    def __init__(self, **options):
+        self.options = options
+        self.pooledModel = None
+
+    # loaded parameters are not sent to other processes
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["pooledModel"] = None
+        return state
+
+    def load(self, params):
+        # pooled parameters are loaded once, pair parameters on every use
+        if not self.pooled:
+            return Model2.load(params, **self.options)
+        if (self.pooledModel is None):
+            self.pooledModel = Model2.load(params, **self.options)
+        return self.pooledModel
+
+    def settings(self):
+        return "model2 {}".format(" ".join(
+            ["{}={}".format(k, v) for (k, v) in sorted(self.options.items())]))
+
+    def trainPooled(self, fileNames):
+        pairs = []
+        for (k, fileName) in enumerate(fileNames):
+            pairs.extend(linePairs(fileName, fileNames[(k + 1) % len(fileNames)]))
+        bitext = Bitext(pairs)
+        model = Model2(**self.options)
+        model.fit(bitext)
+        with open(self.paramsPath(None, None), 'wb') as f:
+            model.save(f, bitext)
+
+    def align(self, file1Name, file2Name, tmpFile, outPrefix, rules):
+        lines = linePairs(file1Name, file2Name)
+        numLines = len(lines)
+        # the rule lines come after the lines of both files, like the fast_align bitext
+        bitext = Bitext(lines + rulePairs(rules))
+        params = None
+        if (self.paramsDir is not None):
+            params = self.paramsPath(file1Name, file2Name)
+        trainingLog = []
+        if (params is not None and not os.path.exists(params)):
+            model = Model2(**self.options)
+            trained = Bitext(lines)
+            model.fit(trained)
+            with open(params, 'wb') as f:
+                model.save(f, trained)
+            trainingLog = model.log
+        if (params is not None):
+            model = self.load(params)
+            (offsets, sources, targets) = model.forceAlign(bitext, Bitext(rulePairs(rules)))
+            model.log = trainingLog + ["forced with {}\n     final tension: {}".format(params, model.tension)]
+        else:
+            model = Model2(**self.options)
+            model.fit(bitext)
+            (offsets, sources, targets) = model.align(bitext)
+        # rule lines are only there for training
+        end = offsets[numLines]
+        alignstore.writeArrays("{}.bin".format(outPrefix),
+                               offsets[:numLines + 1], sources[:end], targets[:end])
+        with codecs.open("{}.log".format(outPrefix), 'w', "utf-8") as log:
+            log.write("\n".join(model.log) + "\n")
+
+BACKENDS = [FastAlignBackend.name, Model2Backend.name]
@@ -0,0 +1,84 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Pivot topology against all pairs: wall time, aligner runs per iteration
+# and total consensus score of saturate, on the same data and seed.
+# python benchmarks/pivots.py DATA_DIR ALIGNER --pivots 1 2 4
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends
+import monolign
+from aligner import Aligner
+from parser import Parser
+
+def run(args, parser, pivots):
+    random.seed(args.seed)
+    backend = backends.FastAlignBackend(args.aligner)
+    if (args.backend == backends.Model2Backend.name):
+        backend = backends.Model2Backend()
+    aligner = Aligner(sys.argv[0], args.data_dir, args.aligner, backend, pivots)
+    if (args.jobs > 1):
+        aligner.startScheduler(args.jobs)
+    parser.fill(aligner.readAll())
+    stdout = sys.stdout
+    t0 = time.time()
+    try:
+        # saturate is chatty
+        sys.stdout = open(os.devnull, 'w')
+        (_, best_inferers) = monolign.saturate(parser, aligner, iterations=args.iterations)
+    finally:
+        sys.stdout = stdout
+        aligner.stopScheduler()
+    t1 = time.time()
+    runs = sum([len(aligner.partners(i)) for i in xrange(aligner.numFiles)])
+    score = sum([inferer.getScore() for inferer in best_inferers])
+    return (t1 - t0, runs, score)
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Benchmark pivot alignment against all pairs")
+    argparser.add_argument("data_dir")
+    argparser.add_argument("aligner")
+    argparser.add_argument("--pivots", type=int, nargs="+", default=[1, 2, 4])
+    argparser.add_argument("--iterations", type=int, default=3)
+    argparser.add_argument("--backend", choices=backends.BACKENDS, default="fast_align")
+    argparser.add_argument("--jobs", type=int, default=1)
+    argparser.add_argument("--seed", type=int, default=0)
+    args = argparser.parse_args()
+    parser = Parser()
+
+    results = []
+    for pivots in [0] + args.pivots:
+        results.append((pivots,) + run(args, parser, pivots))
+        # run directories are named by the second they start in
+        time.sleep(1)
+
+    (_, baseTime, _, baseScore) = results[0]
+    print ("{:>8} {:>10} {:>8} {:>12} {:>9} {:>9}".format(
+        "pivots", "seconds", "runs", "score", "speedup", "score %"))
+    for (pivots, seconds, runs, score) in results:
+        print ("{:>8} {:>10.2f} {:>8} {:>12.3f} {:>9.2f} {:>9.2f}".format(
+            pivots if pivots > 0 else "all", seconds, runs, score,
+            baseTime / seconds, 100 * score / baseScore if baseScore else 0))
@@ -0,0 +1,87 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Latency and throughput of service.py: CLIENTS threads each send REQUESTS
+# requests of BATCH random lines of an edition.
+# python benchmarks/service_load.py http://127.0.0.1:8765 EDITION --clients 8
+
+import argparse
+import codecs
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from service_client import mapLines
+
+def client(args, items, latencies, errors, seed):
+    rng = random.Random(seed)
+    for _ in xrange(args.requests):
+        batch = [rng.choice(items) for _ in xrange(args.batch)]
+        t0 = time.time()
+        try:
+            mapLines(args.url, batch)
+        except Exception, e:
+            errors.append(e)
+            continue
+        latencies.append(time.time() - t0)
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Load test service.py")
+    argparser.add_argument("url")
+    argparser.add_argument("edition")
+    argparser.add_argument("--clients", type=int, default=4)
+    argparser.add_argument("--requests", type=int, default=50, help="requests per client")
+    argparser.add_argument("--batch", type=int, default=1, help="lines per request")
+    argparser.add_argument("--seed", type=int, default=0)
+    args = argparser.parse_args()
+    with codecs.open(args.edition, 'r', "utf-8") as f:
+        lines = f.read().split("\n")
+    if (len(lines) > 0 and len(lines[-1]) == 0):
+        lines.pop()
+    items = list(enumerate(lines))
+
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=client, args=(args, items, latencies, errors, args.seed + k))
+               for k in xrange(args.clients)]
+    t0 = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - t0
+
+    latencies.sort()
+    print ("{} requests of {} lines from {} clients in {:.3f}s, {} errors".format(
+        len(latencies), args.batch, args.clients, elapsed, len(errors)))
+    if (len(latencies) > 0):
+        print ("throughput: {:.1f} requests/s {:.1f} lines/s".format(
+            len(latencies) / elapsed, len(latencies) * args.batch / elapsed))
+        print ("latency ms: mean {:.1f} p50 {:.1f} p90 {:.1f} p99 {:.1f} max {:.1f}".format(
+            1000 * sum(latencies) / len(latencies), 1000 * percentile(latencies, 0.5),
+            1000 * percentile(latencies, 0.9), 1000 * percentile(latencies, 0.99),
+            1000 * latencies[-1]))
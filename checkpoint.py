@@ -0,0 +1,67 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Per-iteration checkpoints of saturate. The state of a finished iteration
+# is pickled into its directory, <newDir>/<iteration>/checkpoint.pkl, as a
+# dict with:
+#   iteration           last completed iteration
+#   best_inferers       best inferer per row
+#   base_rules          rules for the next iteration
+#   random              state of the random module after the iteration
+#   perm                permutation of the iteration
+#   fileNames           editions of the run, in Aligner order
+#   final_alignments    what writeProgress returned
+
+import cPickle
+import os
+
+CHECKPOINT = "checkpoint.pkl"
+
+def save(currDir, state):
+    # written aside and renamed, a crash never leaves half a checkpoint
+    path = os.path.join(currDir, CHECKPOINT)
+    with open("{}.tmp".format(path), 'wb') as f:
+        cPickle.dump(state, f, 2)
+    os.rename("{}.tmp".format(path), path)
+
+def latest(newDir):
+    """
+    returns the state of the last completed iteration in newDir, or None
+    """
+    iterations = [int(name) for name in os.listdir(newDir)
+                  if name.isdigit() and
+                  os.path.exists(os.path.join(newDir, name, CHECKPOINT))]
+    if (len(iterations) == 0):
+        return None
+    with open(os.path.join(newDir, "{}".format(max(iterations)), CHECKPOINT), 'rb') as f:
+        return cPickle.load(f)
+
+def restoreEditions(state, aligner):
+    """
+    Add the editions that were added to the run after it started (see
+    add_edition.py) to aligner, which holds those of the run's data dir.
+    returns whether the run was started on the editions of aligner
+    """
+    fileNames = state["fileNames"]
+    if (fileNames[:aligner.numFiles] != [f.name for f in aligner.fileList]):
+        return False
+    for fileName in fileNames[aligner.numFiles:]:
+        aligner.addFile(fileName)
+    return True
@@ -0,0 +1,154 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Columnar output of an iteration, outputs.npz next to the text outputs.
+# Relations of all rows are stacked, row r owns relations
+# rowOffsets[r]:rowOffsets[r+1], and every per-token column is a
+# relation x edition matrix in file order, -1 where the edition has no
+# member in the relation:
+#   tokens      token index
+#   heads       token index of the head
+#   tags, words index into the tags/words string tables
+# keys holds the consensus string of each relation (as in common.key) as an
+# index into the keys table, scores the score of each row. A string table
+# is stored as utf-8 bytes <name>Data with offsets <name>Offsets.
+
+import numpy as np
+
+OUTPUT = "outputs.npz"
+FORMATS = ["text", "columnar", "both"]
+ABSENT = -1
+
+class StringTable:
+    # interns strings, in order of first use
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, string):
+        if string not in self.ids:
+            self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self.ids[string]
+
+    def arrays(self, name):
+        data = [string.encode("utf-8") for string in self.strings]
+        offsets = np.zeros(len(data) + 1, dtype=np.int64)
+        np.cumsum([len(d) for d in data], out=offsets[1:])
+        return {"{}Data".format(name): np.frombuffer(b"".join(data) or b"\x00", dtype=np.uint8),
+                "{}Offsets".format(name): offsets}
+
+def readStrings(data, name):
+    blob = data["{}Data".format(name)].tostring()
+    offsets = data["{}Offsets".format(name)]
+    return [blob[offsets[k]:offsets[k+1]].decode("utf-8") for k in xrange(len(offsets) - 1)]
+
+def write(path, inferers, fileNames):
+    """
+    inferers : Inferer list     One per row
+    fileNames : string list     Editions, in file order
+    """
+    numFiles = len(fileNames)
+    numRelations = sum([len(inferer.relations) for inferer in inferers])
+    rowOffsets = np.zeros(len(inferers) + 1, dtype=np.int64)
+    np.cumsum([len(inferer.relations) for inferer in inferers], out=rowOffsets[1:])
+    columns = dict((name, np.full((numRelations, numFiles), ABSENT, dtype=np.int32))
+                   for name in ["tokens", "heads", "tags", "words"])
+    keys = np.zeros(numRelations, dtype=np.int32)
+    tables = dict((name, StringTable()) for name in ["keys", "tags", "words", "fileNames"])
+    for fileName in fileNames:
+        tables["fileNames"].intern(fileName)
+    c = 0
+    for inferer in inferers:
+        for r in inferer.relations:
+            keys[c] = tables["keys"].intern(r.finalString())
+            for (ed, structure) in r.structures.items():
+                i = inferer.perm[ed]
+                columns["tokens"][c, i] = structure.i
+                columns["heads"][c, i] = structure.head()
+                columns["tags"][c, i] = tables["tags"].intern(structure.tag())
+                columns["words"][c, i] = tables["words"].intern(structure.string())
+            c += 1
+    arrays = dict(columns)
+    arrays["keys"] = keys
+    arrays["rowOffsets"] = rowOffsets
+    arrays["scores"] = np.array([inferer.getScore() for inferer in inferers], dtype=np.float64)
+    for (name, table) in tables.items():
+        arrays.update(table.arrays(name))
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+class RunOutput:
+    """
+    Reader of an outputs.npz, rows are indexed like the lines of the text
+    outputs and editions like their file indices
+    fileNames : string list     Editions, in file order
+    rowOffsets : int array      Row r owns relations rowOffsets[r]:rowOffsets[r+1]
+    scores : float array        Score of each row
+    tokens, heads, tags, words : int arrays, see above
+    """
+    def __init__(self, path):
+        data = np.load(path)
+        self.data = data
+        self.fileNames = readStrings(data, "fileNames")
+        self.rowOffsets = data["rowOffsets"]
+        self.scores = data["scores"]
+        self.tokens = data["tokens"]
+        self.heads = data["heads"]
+        self.tags = data["tags"]
+        self.words = data["words"]
+        self.keys = data["keys"]
+        self.tables = {}
+
+    def __len__(self):
+        return len(self.rowOffsets) - 1
+
+    def table(self, name):
+        # string tables are only decoded when asked for
+        if name not in self.tables:
+            self.tables[name] = readStrings(self.data, name)
+        return self.tables[name]
+
+    def relations(self, row):
+        return slice(self.rowOffsets[row], self.rowOffsets[row + 1])
+
+    def commonKey(self, row):
+        keys = self.table("keys")
+        return [keys[k] for k in self.keys[self.relations(row)]]
+
+    def pairAlignments(self, row, i, j):
+        # (token of edition i, token of edition j) of the relations they share
+        tokens = self.tokens[self.relations(row)]
+        both = (tokens[:, i] != ABSENT) & (tokens[:, j] != ABSENT)
+        return zip(tokens[both, i].tolist(), tokens[both, j].tolist())
+
+    def alignments(self, row, i):
+        # (token of edition i, relation in row) of the relations it is in
+        tokens = self.tokens[self.relations(row), i]
+        relations = np.nonzero(tokens != ABSENT)[0]
+        return zip(tokens[relations].tolist(), relations.tolist())
+
+    def column(self, row, name, i):
+        """
+        tags or words of edition i in row, by relation, None where absent
+        """
+        strings = self.table(name)
+        return [None if k == ABSENT else strings[k]
+                for k in getattr(self, name)[self.relations(row), i].tolist()]
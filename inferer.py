@@ -18,19 +18,36 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import networkx as nx
-import spacy
+import numpy as np
 import sys
 import time
 
 from collections import defaultdict
+from matching import maxWeightMatching
 from relation import Relation
+from scoring import scorePairs
 from structures import *
+from tokens import Lexicon
 
 THRESHOLD = 4 # higher numebrs speed up solver
 POINTS = 1.0
 BONUS_POINTS = 1.0
+VECTORIZED = True # score all pairs at once with numpy, see scoring.py
+PRUNE = True # only score pairs that can reach THRESHOLD, see candidates
+# what a pair without orth, lemma, alignment or child evidence still needs
+# from shared edges to reach THRESHOLD
+SLACK = THRESHOLD - PARENT_SCORE - POS_SCORE
+
+def numChildren(structure):
+    return sum([len(tokens) for tokens in structure.args.values()])
             
+def writeJoined(write, lines):
+    # write(u"\n".join(lines)) without the joined string
+    for (k, line) in enumerate(lines):
+        if (k > 0):
+            write(u"\n")
+        write(line)
+
 class Inferer:
     """
     Inferrer is technically the correct spelling. There is one inferrer for each
@@ -38,17 +55,24 @@ class Inferer:
     size : int                Number of relations (= num rows = len(relations))
     numEditions : int         Number of editions (<= num cols = len(sentences))
     relations : relation list List of relations 
-    sentences : Doc list      List of sentences
+    sentences : Sentence list List of sentences
+    lexicon : Lexicon         Strings of all sentences
     backMap : (int, int) dict If i = relations[r][ed] then backMap(ed, i) = 
     score : int               Final score of the inferer (-1 if unscored)
+    byOrth, byLemma : dict    Orth/lemma -> indices of relations with such a member
+    bushy : int set           Relations with a member of at least SLACK children
     """
     def __init__(self, perm):
         self.size = 0
         self.numEditions = 0
         self.relations = [] 
         self.sentences = []
+        self.lexicon = Lexicon()
         self.testSentences = []
         self.backMap = {}
+        self.byOrth = defaultdict(set)
+        self.byLemma = defaultdict(set)
+        self.bushy = set()
         self.finalScore = -1
         self.perm = list(perm)
         self.invperm = [x[0] for x in 
@@ -63,10 +87,11 @@ class Inferer:
         """
         Given a parsed tree and alignments, augments the object with either
         new relations or maps words from parsedTree to old relations.
-        parseTree : Doc
+        parseTree : Sentence
         suggested : 2d alignment array with all other parses
         """
         t0 = time.time()
+        parseTree = parseTree.intern(self.lexicon)
         newRelations = self.updateAlignmentsAtOnce(parseTree, suggested)
         t1 = time.time()
         for relation in newRelations:
@@ -85,16 +110,11 @@ class Inferer:
     def updateAlignmentsAtOnce(self, parseTree, suggested):
         """
         Use maximum weight bipartite matching - (|parseTree| + |relations|)^3
-        parseTree: Doc
+        parseTree: Sentence
         suggested: 2d alignment array
         """
         t0 = time.time()
-        G = nx.Graph()
-        structures = [Structure(word, self.numEditions) for word in parseTree]
-        for s in structures:
-            G.add_node(s)
-        for relation in self.relations:
-            G.add_node(relation)
+        structures = [Structure(parseTree, i, self.numEditions) for i in xrange(len(parseTree))]
         t1 = time.time()
         # create a parent matrix
         parentMatrix = self.createParentMatrix(parseTree, suggested)
@@ -102,55 +122,140 @@ class Inferer:
         # note structures is already sorted into a DAG
         # might not be relevant
         prof_scores = []
-        for s in structures:
-            for relationIdx in xrange(len(self.relations)):
+        edges = []
+        if (PRUNE):
+            pairs = [(sIdx, relationIdx) for sIdx in xrange(len(structures))
+                     for relationIdx in self.candidates(structures[sIdx], suggested)]
+        else:
+            pairs = [(sIdx, relationIdx) for sIdx in xrange(len(structures))
+                     for relationIdx in xrange(len(self.relations))]
+        if (VECTORIZED):
+            pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+            scores = scorePairs(structures, self.relations, suggested, parentMatrix,
+                                pairs[:, 0], pairs[:, 1])
+            for k in (scores >= THRESHOLD).nonzero()[0]:
+                score = float(scores[k])
+                edges.append((int(pairs[k, 0]), int(pairs[k, 1]), score))
+                prof_scores.append(score)
+        else:
+            for (sIdx, relationIdx) in pairs:
                 relation = self.relations[relationIdx]
-                score = relation.scoreWith(s, suggested, parentMatrix[relationIdx])
+                score = relation.scoreWith(structures[sIdx], suggested, parentMatrix[relationIdx])
                 if (score >= THRESHOLD):
-                    G.add_edge(s, relation, {'weight': score})
+                    edges.append((sIdx, relationIdx, score))
                     prof_scores.append(score)
         t3 = time.time()
-        bestMatching = nx.max_weight_matching(G)
+        bestMatching = maxWeightMatching(len(structures), len(self.relations), edges)
         t4 = time.time()
-        for relationIdx in xrange(len(self.relations)):
-            relation = self.relations[relationIdx]
-            if relation in bestMatching:
-                newStructure = bestMatching[relation]
-                relation.structureBuffer.append((newStructure, G[relation][newStructure]['weight']))
-                self.backMap[(self.numEditions, newStructure.name.i)] = relationIdx
+        matched = set()
+        for (sIdx, relationIdx, weight) in bestMatching:
+            newStructure = structures[sIdx]
+            self.relations[relationIdx].structureBuffer.append((newStructure, weight))
+            self.backMap[(self.numEditions, newStructure.i)] = relationIdx
+            self.indexStructure(relationIdx, newStructure)
+            matched.add(sIdx)
 
-        unmatched = [Relation(s) for s in structures 
-                     if (s not in bestMatching and not s.shouldIgnore())]
+        unmatched = [Relation(s) for (sIdx, s) in enumerate(structures)
+                     if (sIdx not in matched and not s.shouldIgnore())]
         t5 = time.time()
         if t5 - t0 > 1:
             print ("UAAO: create: {}, matrix: {}, score: {}, match: {}, combine: {}, weights: []".format(t1-t0, t2-t1, t3-t2, t4-t3, t5-t4, prof_scores))
         return unmatched
 
+    def addEdition(self, fileIdx, parseTree, suggested):
+        """
+        infer for the sentence of an edition that is not in perm yet
+        fileIdx : int       File index of the new edition
+        suggested : as in infer, in the order of perm
+        """
+        self.perm.append(fileIdx)
+        self.invperm = [x[0] for x in 
+                        sorted([f for f in enumerate(self.perm, 0)], 
+                               key=lambda x:x[1])]
+        self.infer(parseTree, suggested)
+        # checkpointed relations carry the strings and edges of their last
+        # output, and edges name other relations, which may have changed too
+        for r in self.relations:
+            r.invalidate()
+
+    # the candidate indexes are rebuilt instead of pickled
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ["byOrth", "byLemma", "bushy"]:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.byOrth = defaultdict(set)
+        self.byLemma = defaultdict(set)
+        self.bushy = set()
+        for (relationIdx, relation) in enumerate(self.relations):
+            for structure in relation.structures.values():
+                self.indexStructure(relationIdx, structure)
+
+    def candidates(self, structure, suggested):
+        """
+        Indices of the relations that structure can reach THRESHOLD with.
+        A relation that shares no orth or lemma with it, none of whose members
+        are aligned to it and none of whose members are parents of tokens
+        aligned to its children, scores at most
+        PARENT_SCORE + POS_SCORE + min(children of structure, children of a member)
+        """
+        found = set(self.byOrth.get(structure.orth(), ()))
+        found.update(self.byLemma.get(structure.lemma(), ()))
+        for ed in xrange(len(suggested)):
+            for j in suggested[ed][structure.i]:
+                if (ed, j) in self.backMap:
+                    found.add(self.backMap[(ed, j)])
+            for tokens in structure.args.values():
+                for child in tokens:
+                    for j in suggested[ed][child]:
+                        try:
+                            head = self.sentences[ed].head(j)
+                        except IndexError:
+                            continue
+                        if (ed, head) in self.backMap:
+                            found.add(self.backMap[(ed, head)])
+        if (numChildren(structure) >= SLACK):
+            found.update(self.bushy)
+        return sorted(found)
+
+    def indexStructure(self, relationIdx, structure):
+        """
+        Record that structure joined relations[relationIdx], for candidates
+        """
+        self.byOrth[structure.orth()].add(relationIdx)
+        self.byLemma[structure.lemma()].add(relationIdx)
+        if (numChildren(structure) >= SLACK):
+            self.bushy.add(relationIdx)
+
     def createParentMatrix(self, parseTree, suggested):
         """
         For each word, create a matrix that scores how close it is to all possible parents. This 
         is done by looking at its parent in other sentences. This is later used to determine
         whether two parents share similar children.
-        parseTree: Doc
+        parseTree: Sentence
         suggested: 2d alignment array
         Returns:
         matrix = size by |parseTree| array
         matrix[r][i] = score that r is the parent relation of i.
         """
-        matrix = [[0 for _ in parseTree] for _ in xrange(self.size)]
+        matrix = [[0 for _ in xrange(len(parseTree))] for _ in xrange(self.size)]
         for sIdx in xrange(len(parseTree)):
             for ed in xrange(self.numEditions):
                 tIdxs = suggested[ed][sIdx]
+                t = self.sentences[ed]
                 for tIdx in tIdxs:
                     try:
-                        t = self.sentences[ed][tIdx]
-                        pIdx = t.head.i
+                        pIdx = t.heads[tIdx]
                         try:
                             r = self.backMap[(ed, pIdx)]
                             matrix[r][sIdx] += POINTS / len(tIdxs) 
-                            if (t.dep_ == parseTree[sIdx].dep_):
+                            # both sentences are interned in self.lexicon
+                            if (t.deps[tIdx] == parseTree.deps[sIdx]):
                                 matrix[r][sIdx] += BONUS_POINTS / len(tIdxs)
-                            if (t.head.pos_ == parseTree[sIdx].pos_):
+                            if (t.poses[pIdx] == parseTree.poses[sIdx]):
                                 matrix[r][sIdx] += BONUS_POINTS / len(tIdxs)
                         except KeyError:
                             # Oh well, not found.
@@ -165,7 +270,9 @@ class Inferer:
         Insert a relation into list, update backmap and size
         """
         self.relations.append(relation)
-        self.backMap[(self.numEditions, relation.name.i)] = self.size
+        self.backMap[(self.numEditions, relation.i)] = self.size
+        # the first structure of a new relation is still in its buffer
+        self.indexStructure(self.size, relation.structureBuffer[0][0])
         self.size += 1
         return
 
@@ -179,38 +286,51 @@ class Inferer:
     def predict(self, testLine, suggested):
         # testline is an unparsed line from testfile
         # suggested is an alignment list, suggested[i] corresponds to alignments with filei
-        # max weight between words and structures
+        # (file order, see mapTokens)
         self.testSentences.append(" ".join(testLine))
-        G = nx.Graph()
-        for relation in xrange(self.size):
-            G.add_node(relation)
-        for word in testLine:
-            G.add_node(word)
-
-        for ed in xrange(self.numEditions):
-            for i in xrange(len(testLine)):
-                for j in suggested[ed][i]:
-                    # (test[i], train[j]) are aligned
-                    try:
-                        relation = self.backMap[(self.perm[ed], j)]
-                        if (testLine[i] in G[relation]):
-                            G[relation][testLine[i]]['weight'] += 1
-                        else:
-                            G.add_edge(relation, testLine[i], weight=1)
-                    except Exception, e:
-                        pass
-
-        bestMatching = nx.max_weight_matching(G)
-
+        matches = self.mapTokens(testLine, suggested)
         for relationIdx in xrange(self.size):
             relation = self.relations[relationIdx]
-            if relationIdx in bestMatching:
-                relation.predicts.append(bestMatching[relationIdx])
+            if relationIdx in matches:
+                relation.predicts.append(matches[relationIdx])
             else:
                 relation.predicts.append("")
             # self.backMap update?
         # Ignore unmatched things, don't make new relations
         return None
+
+    def mapTokens(self, testLine, suggested):
+        """
+        Like predict, but leaves the inferer as it is
+        testLine : string list      Tokens, as the aligner split the line
+        suggested : alignments of testLine with each edition, in file order:
+                    suggested[f] is file f, which is edition invperm[f] of
+                    this inferer (unlike infer, whose suggested follows perm)
+        returns relation index -> word of testLine it is matched to
+        """
+        # max weight between words and structures
+        # words are matched by string, repeated words share a node
+        words = []
+        wordIds = {}
+        for word in testLine:
+            if word not in wordIds:
+                wordIds[word] = len(words)
+                words.append(word)
+        weights = defaultdict(int)
+
+        for ed in xrange(self.numEditions):
+            for i in xrange(len(testLine)):
+                for j in suggested[ed][i]:
+                    # (test[i], train[j]) are aligned
+                    key = (self.invperm[ed], j)
+                    # tokens that are in no relation, ignored ones say
+                    if key in self.backMap:
+                        weights[(self.backMap[key], wordIds[testLine[i]])] += 1
+
+        bestMatching = maxWeightMatching(
+            self.size, len(words),
+            [(relation, word, weight) for ((relation, word), weight) in weights.items()])
+        return dict((relation, words[word]) for (relation, word, _) in bestMatching)
         
 
     def score(self):
@@ -222,22 +342,62 @@ class Inferer:
         return self.finalScore
 
 
+    def predicates(self):
+        # records of the relations that predicates.log lists, see Relation.toRecord
+        return [r.toRecord(relationIdx, self.backMap, self.relations)
+                for (relationIdx, r) in enumerate(self.relations)
+                if len(r.getEdges(self.backMap, self.relations)[1]) > 0]
+
     def toString(self):
-        # stackoverflow print function
+        parts = []
+        relations = []
+        self.writeTo(parts.append, relations.append)
+        return (u"".join(parts), u"".join(relations))
+
+    def tableRows(self, final):
+        # header, then a row per relation, see writeTo
         headerRow = [str(self.perm[i]) for i in range(self.numEditions)]
         headerRow.insert(0, "ED:")
         headerRow.append("Predict?")
-        data = [row.toList(self.numEditions) for row in self.relations]
-        for i in xrange(self.size):
-            data[i].insert(0, "{}".format(self.relations[i].finalString()))
-        data.insert(0, headerRow)
-        lens = [max(map(len, col)) for col in zip(*data)]
+        yield headerRow
+        for r in self.relations:
+            row = r.toList(self.numEditions)
+            row.insert(0, "{}".format(r.finalString() if final else r.getString()))
+            yield row
+
+    def writeTo(self, write, writeRelations):
+        """
+        Write what toString returns piece by piece instead of as one string:
+        the table row by row, then the sentences, test sentences and relations.
+        The relations also go to writeRelations.
+        write, writeRelations : string -> None
+        """
+        # stackoverflow print function, columns are measured in a first pass
+        lens = None
+        for row in self.tableRows(True):
+            if (lens is None):
+                lens = map(len, row)
+            else:
+                # zip cuts rows to the shortest, like zip(*table)
+                lens = [max(x, len(col)) for (x, col) in zip(lens, row)]
         fmt = u'\t'.join('{{:{}}}'.format(x) for x in lens)
-        table = u"\n".join([fmt.format(*row) for row in data])
-        sentences = u"\n".join([sent.string for sent in self.sentences])
-        testSentences = u"\n".join(self.testSentences)
-        relations = u"\n".join(["{}".format(r.toString(self.backMap, self.relations)) 
-                                for r in self.relations
-                                if len(r.getEdges(self.backMap, self.relations)[1]) > 0])
-        return (u"{}\n\n{}\n\n{}\n\n{}".format(table, sentences, testSentences, relations),
-                relations)
+        for (k, row) in enumerate(self.tableRows(False)):
+            if (k > 0):
+                write(u"\n")
+            write(fmt.format(*row))
+        write(u"\n\n")
+        writeJoined(write, [sent.text for sent in self.sentences])
+        write(u"\n\n")
+        writeJoined(write, self.testSentences)
+        write(u"\n\n")
+        first = True
+        for r in self.relations:
+            if (len(r.getEdges(self.backMap, self.relations)[1]) == 0):
+                continue
+            if (not first):
+                write(u"\n")
+                writeRelations(u"\n")
+            first = False
+            relation = "{}".format(r.toString(self.backMap, self.relations))
+            write(relation)
+            writeRelations(relation)
@@ -0,0 +1,96 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# maximum weight matching between new structures and existing relations.
+# The graph is always bipartite, so we solve it as an assignment problem.
+
+import networkx as nx
+
+try:
+    import numpy as np
+    from scipy.optimize import linear_sum_assignment
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+except ImportError:
+    linear_sum_assignment = None
+
+# "assignment" (scipy) or "networkx" (general blossom matcher, slow)
+ENGINE = "networkx" if linear_sum_assignment is None else "assignment"
+
+def maxWeightMatching(numLeft, numRight, edges, engine=None):
+    """
+    Maximum weight (not maximum cardinality) matching of a bipartite graph.
+    numLeft, numRight : int          Sizes of the two sides
+    edges : (int, int, float) list   (left, right, weight) with weight > 0
+    returns (int, int, float) list of matched (left, right, weight)
+    """
+    if (len(edges) == 0):
+        return []
+    engine = engine or ENGINE
+    if (engine == "networkx"):
+        return networkxMatching(edges)
+    elif (engine == "assignment"):
+        return assignmentMatching(numLeft, numRight, edges)
+    raise ValueError("Unknown matching engine {}".format(engine))
+
+def networkxMatching(edges):
+    G = nx.Graph()
+    weights = {}
+    for (l, r, weight) in edges:
+        G.add_edge(('l', l), ('r', r), weight=weight)
+        weights[(l, r)] = weight
+    mate = nx.max_weight_matching(G)
+    # networkx 1.x returns a dict with both directions, 2.x a set of pairs
+    if isinstance(mate, dict):
+        mate = [(u, v) for (u, v) in mate.items() if u[0] == 'l']
+    matching = []
+    for (u, v) in mate:
+        if (u[0] == 'r'):
+            (u, v) = (v, u)
+        matching.append((u[1], v[1], weights[(u[1], v[1])]))
+    return sorted(matching)
+
+def assignmentMatching(numLeft, numRight, edges):
+    """
+    Splits the graph into connected components and solves each one as a
+    dense assignment problem, so the matrices stay small on sparse graphs.
+    Missing edges have weight 0 and are dropped from the assignment, which
+    makes the maximum weight assignment a maximum weight matching.
+    """
+    lefts = np.array([e[0] for e in edges])
+    rights = np.array([e[1] for e in edges])
+    weights = np.array([e[2] for e in edges], dtype=np.float64)
+    graph = coo_matrix((np.ones(len(edges)), (lefts, numLeft + rights)),
+                       shape=(numLeft + numRight, numLeft + numRight))
+    (_, labels) = connected_components(graph, directed=False)
+    edgeLabels = labels[lefts]
+    matching = []
+    for label in np.unique(edgeLabels):
+        inComponent = (edgeLabels == label)
+        (rowNodes, rowIdx) = np.unique(lefts[inComponent], return_inverse=True)
+        (colNodes, colIdx) = np.unique(rights[inComponent], return_inverse=True)
+        matrix = np.zeros((len(rowNodes), len(colNodes)))
+        matrix[rowIdx, colIdx] = weights[inComponent]
+        (rows, cols) = linear_sum_assignment(-matrix)
+        for (row, col) in zip(rows, cols):
+            if (matrix[row, col] > 0):
+                matching.append((int(rowNodes[row]), int(colNodes[col]),
+                                 float(matrix[row, col])))
+    return sorted(matching)
@@ -0,0 +1,334 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# IBM Model 2 with fast_align's diagonal alignment prior (Dyer et al. 2013),
+# the model behind `fast_align -d -o -v`. Every (target token, source
+# position or NULL) link of the corpus is a row of flat arrays, so that EM
+# is a handful of vectorized passes instead of a loop over sentences.
+
+import numpy as np
+
+from tokens import Lexicon
+
+ITERATIONS = 5 # the last iteration only decodes, like fast_align
+TENSION = 4.0
+PROB_NULL = 0.08
+ALPHA = 0.01 # Dirichlet prior of variational Bayes
+MIN_TENSION = 0.1
+MAX_TENSION = 14
+TENSION_STEPS = 8
+UNSEEN = 1e-9 # probability of a word pair without a parameter
+BLOCK = 1 << 20 # links per vectorized pass, bounds temporary memory
+
+def digamma(x):
+    # fast_align's asymptotic approximation, vectorized
+    x = np.array(x, dtype=np.float64)
+    result = np.zeros(x.shape)
+    small = x < 7
+    while small.any():
+        result[small] -= 1 / x[small]
+        x[small] += 1
+        small = x < 7
+    x -= 1 / 2
+    xx = 1 / x
+    xx2 = xx * xx
+    xx4 = xx2 * xx2
+    result += (np.log(x) + (1 / 24) * xx2 - (7 / 960) * xx4 +
+               (31 / 8064) * xx4 * xx2 - (127 / 30720) * xx4 * xx4)
+    return result
+
+class Bitext:
+    """
+    Sentence pairs flattened into links. Target token t of line k has one
+    link to NULL followed by one link per source position.
+    srcVocab, trgVocab : Lexicon    Word ids, source id 0 is NULL
+    linkSrc : int array             Source word id of each link
+    linkPos : int array             Source position of each link, -1 for NULL
+    linkToken : int array           Target token of each link
+    linkDelta : float array         i/n - j/m (1-based positions) of each link
+    tokenWord : int array           Word id of each target token
+    tokenLine : int array           Line of each target token
+    tokenPos : int array            Position of each target token in its line
+    tokenInvLen : float array       1 / target length of each token's line
+    sizes : (int, int) dict         (target length, source length) -> lines
+    """
+    def __init__(self, pairs):
+        """
+        pairs: (source token list, target token list) list
+        """
+        self.srcVocab = Lexicon([""])
+        self.trgVocab = Lexicon()
+        self.numLines = len(pairs)
+        self.sizes = {}
+        (linkSrc, linkPos, linkToken, linkDelta) = ([], [], [], [])
+        (tokenWord, tokenLine, tokenPos, tokenInvLen) = ([], [], [], [])
+        numTokens = 0
+        for (k, (src, trg)) in enumerate(pairs):
+            (n, m) = (len(src), len(trg))
+            if (n == 0 or m == 0):
+                continue
+            self.sizes[(m, n)] = self.sizes.get((m, n), 0) + 1
+            s = np.array([0] + [self.srcVocab.intern(w) for w in src], dtype=np.int32)
+            tokenWord.append(np.array([self.trgVocab.intern(w) for w in trg], dtype=np.int32))
+            tokenLine.append(np.repeat(np.int32(k), m))
+            tokenPos.append(np.arange(m, dtype=np.int32))
+            tokenInvLen.append(np.repeat(1 / m, m))
+            linkSrc.append(np.tile(s, m))
+            linkPos.append(np.tile(np.arange(-1, n, dtype=np.int32), m))
+            linkToken.append(np.repeat(np.arange(numTokens, numTokens + m, dtype=np.int32), n + 1))
+            delta = np.zeros((m, n + 1))
+            delta[:, 1:] = (np.arange(1, n + 1) / n)[None, :] - (np.arange(1, m + 1) / m)[:, None]
+            linkDelta.append(delta.ravel())
+            numTokens += m
+        concat = lambda arrays, dtype: (np.concatenate(arrays) if len(arrays) > 0
+                                        else np.zeros(0, dtype=dtype))
+        self.linkSrc = concat(linkSrc, np.int32)
+        self.linkPos = concat(linkPos, np.int32)
+        self.linkToken = concat(linkToken, np.int32)
+        self.linkDelta = concat(linkDelta, np.float64)
+        self.tokenWord = concat(tokenWord, np.int32)
+        self.tokenLine = concat(tokenLine, np.int32)
+        self.tokenPos = concat(tokenPos, np.int32)
+        self.tokenInvLen = concat(tokenInvLen, np.float64)
+        self.numTokens = numTokens
+        # word pair keys, one parameter per distinct pair
+        self.linkKey = (self.linkSrc.astype(np.int64) * max(len(self.trgVocab), 1) +
+                        self.tokenWord[self.linkToken])
+        # passes cover whole tokens
+        tokenStarts = np.searchsorted(self.linkToken, np.arange(numTokens + 1))
+        tokenBounds = np.unique(np.append(
+            np.searchsorted(tokenStarts, np.arange(0, len(self.linkToken), BLOCK)), numTokens))
+        self.blocks = [(tokenStarts[lo], tokenStarts[hi], lo, hi)
+                       for (lo, hi) in zip(tokenBounds[:-1], tokenBounds[1:]) if hi > lo]
+
+    def pairKeys(self):
+        # (source word, target word) of every key, for translating tables
+        keys = np.unique(self.linkKey)
+        width = max(len(self.trgVocab), 1)
+        return (keys, keys // width, keys % width)
+
+class Model2:
+    """
+    fast_align's reparameterized IBM Model 2
+    keys : int array        Sorted word pair keys of the bitext trained on
+    probs : float array     t(target word | source word) per key
+    counts : float array    Expected counts per key of the last E-step
+    tension : float         Sharpness of the diagonal prior
+    saved : dict            Parameters read by load, by word strings
+    """
+    def __init__(self, iterations=ITERATIONS, tension=TENSION, probNull=PROB_NULL,
+                 alpha=ALPHA, favorDiagonal=True, optimizeTension=True,
+                 variationalBayes=True):
+        self.iterations = iterations
+        self.tension = tension
+        self.probNull = probNull
+        self.alpha = alpha
+        self.favorDiagonal = favorDiagonal
+        self.optimizeTension = optimizeTension
+        self.variationalBayes = variationalBayes
+        self.keys = None
+        self.probs = None
+        self.counts = None
+        self.saved = None
+        self.log = []
+
+    def prior(self, bitext, lo, hi, tokLo, tokHi):
+        # p(link) before the translation table, NULL links get probNull
+        null = bitext.linkPos[lo:hi] < 0
+        tokens = bitext.linkToken[lo:hi] - tokLo
+        if (not self.favorDiagonal):
+            # uniform over the source positions and NULL
+            prior = 1 / np.bincount(tokens, minlength=tokHi - tokLo)[tokens]
+            return (prior, tokens, null)
+        unnormalized = np.exp(-self.tension * np.abs(bitext.linkDelta[lo:hi]))
+        unnormalized[null] = 0
+        z = np.bincount(tokens, unnormalized, minlength=tokHi - tokLo)
+        prior = unnormalized / z[tokens] * (1 - self.probNull)
+        prior[null] = self.probNull
+        return (prior, tokens, null)
+
+    def translation(self, keys, probs, linkKey):
+        # t of each link, UNSEEN for pairs without a parameter
+        if (keys is None or len(keys) == 0):
+            return np.ones(len(linkKey))
+        where = np.minimum(np.searchsorted(keys, linkKey), len(keys) - 1)
+        return np.where(keys[where] == linkKey, probs[where], UNSEEN)
+
+    def expect(self, bitext, keys, probs, params):
+        """
+        E-step over bitext
+        returns expected counts per params index, the posterior diagonal
+        feature per target token and the log likelihood
+        """
+        counts = np.zeros(len(params))
+        empFeat = 0
+        likelihood = 0
+        for (lo, hi, tokLo, tokHi) in bitext.blocks:
+            (prior, tokens, null) = self.prior(bitext, lo, hi, tokLo, tokHi)
+            prob = self.translation(keys, probs, bitext.linkKey[lo:hi]) * prior
+            total = np.bincount(tokens, prob, minlength=tokHi - tokLo)
+            posterior = prob / total[tokens]
+            counts += np.bincount(np.searchsorted(params, bitext.linkKey[lo:hi]),
+                                  posterior, minlength=len(params))
+            # like fast_align, the feature uses the 0-based target position
+            feature = -np.abs(bitext.linkDelta[lo:hi] +
+                              bitext.tokenInvLen[bitext.linkToken[lo:hi]])
+            empFeat += (feature * posterior)[~null].sum()
+            likelihood += np.log(total).sum()
+        return (counts, empFeat / max(bitext.numTokens, 1), likelihood)
+
+    def normalize(self, params, counts, width):
+        # M-step, one distribution per source word
+        rows = params // width
+        if (self.variationalBayes):
+            totals = np.bincount(rows, counts + self.alpha)
+            return np.exp(digamma(counts + self.alpha) - digamma(totals[rows]))
+        totals = np.bincount(rows, counts)
+        return counts / totals[rows]
+
+    def fitTension(self, bitext, empFeat):
+        # gradient steps matching the expected diagonal feature to empFeat
+        (cells, groups, weights) = ([], [], [])
+        group = 0
+        for ((m, n), count) in sorted(bitext.sizes.items()):
+            feature = -np.abs((np.arange(1, n + 1) / n)[None, :] -
+                              (np.arange(1, m + 1) / m)[:, None])
+            cells.append(feature.ravel())
+            groups.append(np.repeat(np.arange(group, group + m), n))
+            weights.append(np.repeat(count, m))
+            group += m
+        if (group == 0):
+            return
+        cells = np.concatenate(cells)
+        groups = np.concatenate(groups)
+        weights = np.concatenate(weights)
+        for _ in xrange(TENSION_STEPS):
+            unnormalized = np.exp(self.tension * cells)
+            dLogZ = (np.bincount(groups, cells * unnormalized) /
+                     np.bincount(groups, unnormalized))
+            modFeat = (weights * dLogZ).sum() / bitext.numTokens
+            self.tension += (empFeat - modFeat) * 20
+            self.tension = min(max(self.tension, MIN_TENSION), MAX_TENSION)
+
+    def fit(self, bitext):
+        """
+        EM for all but the last of the iterations
+        """
+        (params, _, _) = bitext.pairKeys()
+        width = max(len(bitext.trgVocab), 1)
+        # uniform t: the first E-step only sees the prior
+        probs = np.ones(len(params))
+        counts = np.zeros(len(params))
+        self.log = []
+        for iteration in xrange(self.iterations - 1):
+            (counts, empFeat, likelihood) = self.expect(bitext, params, probs, params)
+            if (self.favorDiagonal and self.optimizeTension and iteration > 0):
+                self.fitTension(bitext, empFeat)
+            probs = self.normalize(params, counts, width)
+            self.log.append("ITERATION {}\n  log_e likelihood: {}\n posterior al-feat: {}\n"
+                            "     final tension: {}".format(
+                                iteration + 1, likelihood, empFeat, self.tension))
+        (self.keys, self.probs, self.counts) = (params, probs, counts)
+
+    def save(self, f, bitext):
+        """
+        Write the parameters fit on bitext, by word strings so that they
+        apply to other bitexts
+        """
+        (_, src, trg) = bitext.pairKeys()
+        np.savez(f, srcWords=np.array(bitext.srcVocab.strings, dtype=np.unicode_),
+                 trgWords=np.array(bitext.trgVocab.strings, dtype=np.unicode_),
+                 src=src, trg=trg, probs=self.probs, counts=self.counts,
+                 tension=np.array([self.tension]))
+
+    @classmethod
+    def load(cls, f, **options):
+        model = cls(**options)
+        data = np.load(f)
+        model.saved = dict((name, data[name]) for name in data.files)
+        model.tension = float(model.saved["tension"][0])
+        return model
+
+    def translate(self, bitext, srcWords, trgWords, src, trg, values, default):
+        """
+        values of (srcWords[src], trgWords[trg]) pairs, moved to the keys of
+        bitext; keys without a value get default
+        """
+        (keys, _, _) = bitext.pairKeys()
+        result = np.repeat(np.float64(default), len(keys))
+        if (len(keys) == 0 or len(src) == 0):
+            return result
+        srcMap = np.array([bitext.srcVocab.ids.get(w, -1) for w in srcWords], dtype=np.int64)
+        trgMap = np.array([bitext.trgVocab.ids.get(w, -1) for w in trgWords], dtype=np.int64)
+        (s, t) = (srcMap[src], trgMap[trg])
+        known = (s >= 0) & (t >= 0)
+        moved = s[known] * max(len(bitext.trgVocab), 1) + t[known]
+        where = np.minimum(np.searchsorted(keys, moved), len(keys) - 1)
+        found = keys[where] == moved
+        result[where[found]] = values[known][found]
+        return result
+
+    def forceAlign(self, bitext, rules=None):
+        """
+        Decode bitext with loaded parameters, no training. The expected counts
+        of the rule lines (a Bitext) under the loaded parameters are added to
+        the saved counts first, as one more M-step.
+        """
+        saved = self.saved
+        (keys, _, _) = bitext.pairKeys()
+        counts = self.translate(bitext, saved["srcWords"], saved["trgWords"],
+                                saved["src"], saved["trg"], saved["counts"], 0)
+        if (rules is not None and rules.numTokens > 0):
+            (ruleKeys, ruleSrc, ruleTrg) = rules.pairKeys()
+            ruleProbs = self.translate(rules, saved["srcWords"], saved["trgWords"],
+                                       saved["src"], saved["trg"], saved["probs"], UNSEEN)
+            (ruleCounts, _, _) = self.expect(rules, ruleKeys, ruleProbs, ruleKeys)
+            counts += self.translate(bitext, rules.srcVocab.strings, rules.trgVocab.strings,
+                                     ruleSrc, ruleTrg, ruleCounts, 0)
+        probs = self.normalize(keys, counts, max(len(bitext.trgVocab), 1))
+        return self.align(bitext, keys, probs)
+
+    def align(self, bitext, keys=None, probs=None):
+        """
+        Viterbi alignments of bitext, NULL wins ties and then the leftmost
+        source position
+        returns offsets, sources and targets in the CSR layout of alignstore
+        """
+        if (keys is None):
+            (keys, probs) = (self.keys, self.probs)
+        (lines, sources, targets) = ([], [], [])
+        for (lo, hi, tokLo, tokHi) in bitext.blocks:
+            (prior, tokens, null) = self.prior(bitext, lo, hi, tokLo, tokHi)
+            prob = self.translation(keys, probs, bitext.linkKey[lo:hi]) * prior
+            starts = np.searchsorted(tokens, np.arange(tokHi - tokLo))
+            best = np.maximum.reduceat(prob, starts)
+            links = np.where(prob == best[tokens], np.arange(hi - lo), hi - lo)
+            first = np.minimum.reduceat(links, starts)
+            first = first[~null[first]]
+            chosen = bitext.linkToken[lo:hi][first]
+            lines.append(bitext.tokenLine[chosen])
+            sources.append(bitext.linkPos[lo:hi][first])
+            targets.append(bitext.tokenPos[chosen])
+        lines = np.concatenate(lines) if len(lines) > 0 else np.zeros(0, dtype=np.int32)
+        offsets = np.zeros(bitext.numLines + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lines, minlength=bitext.numLines), out=offsets[1:])
+        concat = lambda arrays: (np.concatenate(arrays) if len(arrays) > 0
+                                 else np.zeros(0, dtype=np.int32))
+        return (offsets, concat(sources), concat(targets))
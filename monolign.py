@@ -17,50 +17,215 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import argparse
+import backends
+import checkpoint
 import codecs
+import columnar
+import hashlib
+import matching
+import multiprocessing
+import os
+import random
 import sys
 import time
+import traceback
 from spacy.en import English
 
 from aligner import *
 from inferer import Inferer
 from structures import *
 from parser import Parser
+from rowworkers import RowWorkers
+from scheduler import AlignmentPipeline
 
 ITERATIONS = 10
+CURVE = "curve.tsv"
 
-def processFile(parser, aligner, inferers, new_rules, base_rules, fileiIdx, iteration):
+def alignFile(aligner, new_rules, base_rules, fileiIdx):
     """
-    Process a single file by:
-    1. Alignment to all existing files
-    2. Parsing each line
-    3. Updating the inferer for each line
-    
+    Align a single file to all existing files.
+    returns the lines of the file, its alignments and the time spent
+    creating the dir and aligning
     """
     t0 = time.time()
     #create a working directory
-    aligner.createDir(fileiIdx)
+    if (aligner.scheduler is None):
+        aligner.createDir(fileiIdx)
     # align to previous files
     filei = aligner.read(fileiIdx)
     t1 = time.time()
     # maybe in the future we only need to align once to save dev time
-    for filejIdx in xrange(fileiIdx):
-        aligner.alignWith(fileiIdx, filejIdx, new_rules, base_rules)
-    t2 = time.time()
+    # with a scheduler the pairs are already running, loading waits on them
+    if (aligner.scheduler is None):
+        for filejIdx in aligner.partners(fileiIdx):
+            aligner.alignWith(fileiIdx, filejIdx, new_rules, base_rules)
     alignments = aligner.loadAlignments(fileiIdx)
+    t2 = time.time()
+    return (filei, alignments, t1-t0, t2-t1)
 
+def inferFile(parser, aligner, inferers, new_rules, filei, alignments, frozen):
+    """
+    Parse each line of an aligned file and update the inferer for each line,
+    except for frozen rows
+    """
     for row in xrange(aligner.size): 
+        if (frozen[row]):
+            continue
         parsedTree = parser.parse(filei[row])
         score = inferers[row].infer(parsedTree, [ed[row] for ed in alignments])
         theseRules = inferers[row].extractRules()
         new_rules[row].extend(theseRules)
-    t3 = time.time()
-    print ("Process file times: creating dir: {} aligning: {} inferring: {}".format(t1-t0, t2-t1, t3-t2))
+
+def processFile(aligner, infer, new_rules, base_rules, fileiIdx, iteration):
+    """
+    Process a single file by:
+    1. Alignment to all existing files
+    2. Parsing each line
+    3. Updating the inferer for each line
+    infer(filei, alignments) does 2. and 3., see saturate
+    """
+    (filei, alignments, tDir, tAlign) = alignFile(aligner, new_rules, base_rules, fileiIdx)
+    t0 = time.time()
+    infer(filei, alignments)
+    t1 = time.time()
+    print ("Process file times: creating dir: {} aligning: {} inferring: {}".format(tDir, tAlign, t1-t0))
+
+def processFilesPipelined(aligner, infer, new_rules, base_rules, depth):
+    """
+    Same as calling processFile on every file, but file i+1 is aligned on a
+    background thread while file i is inferred. At most depth aligned files
+    wait in the queue.
+    """
+    pipeline = AlignmentPipeline(
+        lambda fileiIdx: alignFile(aligner, new_rules, base_rules, fileiIdx),
+        aligner.numFiles, depth)
+    pipeline.start()
+    t0 = time.time()
+    for (filei, alignments, tDir, tAlign) in pipeline:
+        t1 = time.time()
+        infer(filei, alignments)
+        t2 = time.time()
+        print ("Process file times: creating dir: {} aligning: {} inferring: {} waiting: {}".format(
+            tDir, tAlign, t2-t1, t1-t0))
+        t0 = t2
     
-def saturate(parser, aligner):
+def runIteration(parser, aligner, pipelineDepth, rowWorkers, base_rules, best_inferers, frozen):
+    """
+    Align and infer every file in the current order of aligner
+    returns:
+    rule list per row
+    score per row
+    row -> inferer dict of the rows that beat best_inferers
+    """
+    perm = aligner.perm
+    new_rules = [[] for i in xrange(aligner.size)]
+    if (rowWorkers is None):
+        inferers = [best_inferers[i] if frozen[i] else Inferer(perm)
+                    for i in xrange(aligner.size)]
+        infer = lambda filei, alignments: inferFile(
+            parser, aligner, inferers, new_rules, filei, alignments, frozen)
+    else:
+        rowWorkers.start(perm, [None if inferer is None else inferer.getScore()
+                                for inferer in best_inferers], frozen)
+        infer = lambda filei, alignments: rowWorkers.infer(parser, filei, alignments)
+    if (aligner.scheduler is not None):
+        aligner.alignAll(new_rules, base_rules)
+    if (pipelineDepth > 0):
+        processFilesPipelined(aligner, infer, new_rules, base_rules, pipelineDepth)
+    else:
+        for fileiIdx in xrange(aligner.numFiles):
+            # clear the outdated rules:
+            processFile(aligner, infer, new_rules, base_rules, fileiIdx, aligner.iteration)
+    if (rowWorkers is not None):
+        return rowWorkers.finish()
+    [inferers[i].score() for i in xrange(aligner.size) if not frozen[i]]
+    scores = [inferer.getScore() for inferer in inferers]
+    improved = {}
+    for i in xrange(aligner.size):
+        if (best_inferers[i] == None or 
+            best_inferers[i].getScore() < inferers[i].getScore()):
+            improved[i] = inferers[i]
+    return (new_rules, scores, improved)
+
+def restartSeed(seed, iteration, restart):
+    # same seed, same permutations, whatever ran before
+    return int(hashlib.sha1("{}:{}:{}".format(seed, iteration, restart)).hexdigest(), 16)
+
+def runRestart(conn, parser, aligner, restart, seed, pipelineDepth, base_rules,
+               best_inferers, frozen):
+    # body of a restart process, forked with the state of the barrier
+    try:
+        random.seed(restartSeed(seed, aligner.iteration, restart))
+        aligner.reopen()
+        aligner.update(aligner.iteration, restart)
+        aligner.shuffle()
+        result = runIteration(parser, aligner, pipelineDepth, None, base_rules,
+                              best_inferers, frozen)
+        aligner.clean()
+        conn.send(("done", result))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    conn.close()
+
+def runRestarts(parser, aligner, restarts, seed, pipelineDepth, base_rules, best_inferers, frozen):
+    """
+    Run an iteration as restarts independent processes, each with its own
+    permutation, then merge them row by row: a row takes the rules and score
+    of the restart that scored it highest, and its inferer if that beats
+    best_inferers.
+    returns what runIteration does, and the total score of each restart
+    """
+    conns = []
+    processes = []
+    for restart in xrange(restarts):
+        (parentEnd, childEnd) = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=runRestart,
+            args=(childEnd, parser, aligner, restart, seed, pipelineDepth,
+                  base_rules, best_inferers, frozen))
+        process.start()
+        childEnd.close()
+        conns.append(parentEnd)
+        processes.append(process)
+    results = []
+    for (restart, conn) in enumerate(conns):
+        reply = conn.recv()
+        processes[restart].join()
+        if (reply[0] == "error"):
+            raise RuntimeError("Restart {} failed:\n{}".format(restart, reply[1]))
+        results.append(reply[1])
+    new_rules = []
+    scores = []
+    improved = {}
+    for i in xrange(aligner.size):
+        # first restart wins ties
+        winner = max(xrange(restarts), key=lambda r: (results[r][1][i], -r))
+        (rules, restartScores, restartImproved) = results[winner]
+        new_rules.append(rules[i])
+        scores.append(restartScores[i])
+        if (i in restartImproved):
+            improved[i] = restartImproved[i]
+    return (new_rules, scores, improved, [sum(result[1]) for result in results])
+
+def saturate(parser, aligner, pipelineDepth=0, rowWorkers=None, resume=None,
+             iterations=ITERATIONS, tolerance=None, patience=0, restarts=1, seed=0,
+             logs="all"):
     """
     parser - English parser
     aligner - our Aligner object
+    pipelineDepth - if > 0, overlap alignment and inference with a queue this deep
+    rowWorkers - if given, a RowWorkers that infers the rows instead of this process
+    resume - checkpoint state to continue from, see checkpoint.py
+    iterations - most iterations to run
+    tolerance - if given, stop once an iteration raises the total score by less
+    patience - if > 0, freeze rows whose best score has not improved for this
+               many iterations: they are no longer parsed or inferred and keep
+               their best inferer and the rules it produced
+    restarts - if > 1, every iteration runs this many permutations side by side
+               in separate processes (see runRestarts), seeded from seed
+    logs - "final" writes the full logs of the last iteration only and the
+           score reports of the others, "all" full logs every iteration
 
     returns:
     inferer list
@@ -74,52 +239,227 @@ def saturate(parser, aligner):
     final_alignments = ""
     # Do for multiple iterations
     best_inferers = [None for _ in xrange(aligner.size)]
-    for iteration in xrange(ITERATIONS):
+    # rules of the iteration each best inferer comes from
+    best_rules = [[] for _ in xrange(aligner.size)]
+    # iterations since the best score of a row last improved
+    stale = [0 for _ in xrange(aligner.size)]
+    start = 0
+    if (resume is not None):
+        base_rules = resume["base_rules"]
+        final_alignments = resume["final_alignments"]
+        best_inferers = resume["best_inferers"]
+        best_rules = resume.get("best_rules", best_rules)
+        stale = resume.get("stale", stale)
+        start = resume["iteration"] + 1
+        if (resume.get("converged", False)):
+            print ("Converged after iteration {}".format(resume["iteration"]))
+            start = iterations
+    tStart = time.time()
+    for iteration in xrange(start, iterations):
         t0 = time.time()
         aligner.update(iteration)
-        perm = aligner.shuffle()
-        new_rules = [[] for i in xrange(aligner.size)]
-        inferers = [Inferer(perm) for i in xrange(aligner.size)]
+        frozen = [patience > 0 and stale[i] >= patience for i in xrange(aligner.size)]
+        previousTotal = None
+        if (None not in best_inferers):
+            previousTotal = sum([inferer.getScore() for inferer in best_inferers])
         print ("Iteration {}".format(iteration), end="\n")
+        if (any(frozen)):
+            print ("Frozen rows: {}".format(sum(frozen)))
         t1 = time.time()
-        for fileiIdx in xrange(aligner.numFiles):
-            # clear the outdated rules:
-            processFile(parser, aligner, inferers, new_rules, base_rules, fileiIdx, iteration)
-        t2 = time.time()
-        [inferer.score() for inferer in inferers]
-
+        if (restarts > 1):
+            # the restarts shuffle their own copies of the order
+            perm = aligner.perm
+            (new_rules, scores, improved, restartScores) = runRestarts(
+                parser, aligner, restarts, seed, pipelineDepth, base_rules, best_inferers, frozen)
+        else:
+            perm = aligner.shuffle()
+            (new_rules, scores, improved) = runIteration(
+                parser, aligner, pipelineDepth, rowWorkers, base_rules, best_inferers, frozen)
+            restartScores = [sum(scores)]
         for i in xrange(aligner.size):
-            if (best_inferers[i] == None or 
-                best_inferers[i].getScore() < inferers[i].getScore()):
-                best_inferers[i] = inferers[i]
+            if (i in improved):
+                best_inferers[i] = improved[i]
+                best_rules[i] = new_rules[i]
+                stale[i] = 0
+            else:
+                stale[i] += 1
+            if (frozen[i]):
+                new_rules[i] = best_rules[i]
+        t2 = time.time()
             
-        final_alignments = aligner.writeProgress(best_inferers, new_rules, t0)
+        total = sum([inferer.getScore() for inferer in best_inferers])
+        converged = ((tolerance is not None and previousTotal is not None and
+                      total - previousTotal < tolerance) or
+                     (patience > 0 and min(stale) >= patience))
+        final = converged or iteration == iterations - 1
+        final_alignments = aligner.writeProgress(best_inferers, new_rules, t0,
+                                                 logs == "all" or final)
         base_rules = list(collapseRules(new_rules))
         aligner.clean()
         print ("Orig. Score {}, Total Score {}".format(
-            sum([inferer.getScore() for inferer in inferers]),
-            sum([inferer.getScore() for inferer in best_inferers])
+            sum(scores),
+            total
         ))
-        aligner.writePairAlignments(best_inferers)
-        aligner.writeCommonAlignments(best_inferers)
-        aligner.writePOSHeads(best_inferers)
+        aligner.writeOutputs(best_inferers)
+        writeCurve(aligner.newDir, iteration, t2 - tStart, total, restartScores)
+        checkpoint.save(aligner.currDir, {
+            "iteration": iteration,
+            "best_inferers": best_inferers,
+            "best_rules": best_rules,
+            "stale": stale,
+            "converged": converged,
+            "base_rules": base_rules,
+            "random": random.getstate(),
+            "perm": list(perm),
+            "fileNames": [f.name for f in aligner.fileList],
+            "final_alignments": final_alignments,
+        })
         t3 = time.time()
         print ("Prep: {} Processing files: {} Inferring: {}".format(t1-t0, t2-t1, t3-t2))
+        if (converged):
+            print ("Converged after iteration {}".format(iteration))
+            break
     return (final_alignments, best_inferers)
+
+def writeCurve(newDir, iteration, seconds, total, restartScores):
+    """
+    Append a line to newDir/curve.tsv: iteration, seconds since saturate
+    started, total best score and the total score of each restart
+    """
+    path = os.path.join(newDir, CURVE)
+    if (iteration == 0 or not os.path.exists(path)):
+        with codecs.open(path, 'w', "utf-8") as curve:
+            curve.write(u"iteration\tseconds\ttotal\trestarts\n")
+    with codecs.open(path, 'a', "utf-8") as curve:
+        curve.write(u"{}\t{:.3f}\t{}\t{}\n".format(
+            iteration, seconds, total, ",".join(["{}".format(score) for score in restartScores])))
     
+def parseArgs():
+    argparser = argparse.ArgumentParser(description="Derive consensus alignments for a multi-parallel corpus")
+    argparser.add_argument("data_dir", help="directory of line-parallel .txt editions")
+    argparser.add_argument("aligner", help="location of fast_align (unused by --backend model2)")
+    argparser.add_argument("test_file", nargs="?", default=None,
+                           help="edition to predict onto the consensus after training")
+    argparser.add_argument("--backend", choices=backends.BACKENDS, default="fast_align",
+                           help="pairwise aligner: the fast_align binary, or an in-process "
+                           "IBM Model 2 equivalent to fast_align -d -o -v")
+    argparser.add_argument("--pivots", type=int, default=0, metavar="K",
+                           help="align each edition only to the first K editions of the "
+                           "iteration's order and compose the other pairs through them "
+                           "(0 aligns all pairs)")
+    argparser.add_argument("--train-once", choices=["pair", "pooled"], default=None,
+                           help="train aligner parameters once per pair, or once on a pooled "
+                           "corpus of all editions, and only decode in later iterations")
+    argparser.add_argument("--align-cache", default=None, metavar="DIR",
+                           help="keep pairwise alignments in DIR, keyed by file contents, "
+                           "rules and aligner flags, and reuse them instead of realigning")
+    argparser.add_argument("--align-cache-budget", type=int, default=2048, metavar="MB",
+                           help="disk budget of the alignment cache, least recently used "
+                           "entries are evicted first")
+    argparser.add_argument("--jobs", type=int, default=1,
+                           help="number of alignment worker processes (1 aligns serially)")
+    argparser.add_argument("--parse-cache", default=None, metavar="DIR",
+                           help="keep parses on disk in DIR and reuse them in later runs")
+    argparser.add_argument("--parse-workers", type=int, default=1,
+                           help="number of processes parsing the corpus up front")
+    argparser.add_argument("--parse-batch", type=int, default=1000,
+                           help="sentences per nlp.pipe batch when parsing the corpus")
+    argparser.add_argument("--matcher", choices=["assignment", "networkx"],
+                           default=matching.ENGINE,
+                           help="bipartite matching engine (assignment needs scipy)")
+    argparser.add_argument("--pipeline", type=int, default=0, metavar="DEPTH",
+                           help="align the next files in the background while inferring, "
+                           "keeping at most DEPTH aligned files queued (0 disables)")
+    argparser.add_argument("--infer-workers", type=int, default=1,
+                           help="number of processes inferring rows, each owning a block "
+                           "of rows (1 infers in this process)")
+    argparser.add_argument("--output-format", choices=columnar.FORMATS, default="text",
+                           help="per-iteration outputs: the text files (pair_alignments/, "
+                           "alignments/, pos/, heads/, words/), a columnar outputs.npz "
+                           "(see columnar.py), or both")
+    argparser.add_argument("--logs", choices=LOGS, default="all",
+                           help="final: write alignments.log, predicates.log and "
+                           "predicates.jsonl in full for the last iteration only, and "
+                           "just the score reports for the others")
+    argparser.add_argument("--gzip-logs", action="store_true",
+                           help="gzip the logs of every iteration (alignments.log.gz, ...)")
+    argparser.add_argument("--iterations", type=int, default=ITERATIONS,
+                           help="most iterations to run")
+    argparser.add_argument("--tolerance", type=float, default=None,
+                           help="stop once an iteration raises the total score by less "
+                           "than this")
+    argparser.add_argument("--patience", type=int, default=0, metavar="N",
+                           help="freeze rows whose best score has not improved for N "
+                           "iterations: later iterations skip their parsing and inference "
+                           "and reuse their best alignments and rules (0 disables)")
+    argparser.add_argument("--restarts", type=int, default=1, metavar="R",
+                           help="run every iteration as R independent permutations in "
+                           "separate processes and keep the best inferer of each row "
+                           "(1 runs one permutation per iteration)")
+    argparser.add_argument("--seed", type=int, default=0,
+                           help="seed of the permutations of --restarts")
+    argparser.add_argument("--resume", default=None, metavar="DIR",
+                           help="continue the run in DIR (an _aligns directory) after its "
+                           "last completed iteration")
+    args = argparser.parse_args()
+    if (args.restarts > 1 and (args.jobs > 1 or args.infer_workers > 1)):
+        argparser.error("restarts align and infer serially, --restarts can not be "
+                        "combined with --jobs or --infer-workers")
+    return args
+
 if __name__ == "__main__":
     #init
+    args = parseArgs()
+    matching.ENGINE = args.matcher
     t0 = time.time()
-    parser = Parser()
-    aligner = Aligner(sys.argv[0], sys.argv[1], sys.argv[2])
+    backend = backends.FastAlignBackend(args.aligner)
+    if (args.backend == backends.Model2Backend.name):
+        backend = backends.Model2Backend()
+    resume = None
+    if (args.resume is not None):
+        resume = checkpoint.latest(args.resume)
+        if (resume is None):
+            sys.exit("No checkpoint to resume from in {}".format(args.resume))
+    aligner = Aligner(sys.argv[0], args.data_dir, args.aligner, backend, args.pivots,
+                      args.resume)
+    if (resume is not None):
+        if (resume["fileNames"] != [f.name for f in aligner.fileList]):
+            sys.exit("{} was run on other editions than {}".format(args.resume, args.data_dir))
+        print ("Resuming after iteration {}".format(resume["iteration"]))
+        aligner.perm = resume["perm"]
+        random.setstate(resume["random"])
+    aligner.outputFormat = args.output_format
+    aligner.compressLogs = args.gzip_logs
+    if (args.align_cache is not None):
+        aligner.useCache(args.align_cache, args.align_cache_budget * (1 << 20))
+    if (args.train_once is not None):
+        try:
+            backend.trainOnce(os.path.join(aligner.newDir, "params"), args.train_once == "pooled",
+                              [f.name for f in aligner.fileList])
+        except ValueError, e:
+            sys.exit("{}".format(e))
+    # start workers before the parser model is loaded
+    if (args.jobs > 1):
+        aligner.startScheduler(args.jobs)
+    rowWorkers = None
+    if (args.infer_workers > 1):
+        rowWorkers = RowWorkers(aligner.size, args.infer_workers)
+    parser = Parser(args.parse_cache)
+    parser.fill(aligner.readAll(), args.parse_batch, args.parse_workers)
 
 
     t1 = time.time()
-    (final_alignments, best_inferers) = saturate(parser, aligner)
+    (final_alignments, best_inferers) = saturate(
+        parser, aligner, args.pipeline, rowWorkers, resume,
+        args.iterations, args.tolerance, args.patience, args.restarts, args.seed,
+        args.logs)
+    aligner.stopScheduler()
+    if (rowWorkers is not None):
+        rowWorkers.close()
     t2 = time.time()
 
-    if (len(sys.argv) > 3):
-        testFile = codecs.open(sys.argv[3], 'r', encoding='utf-8')
+    if (args.test_file is not None):
+        testFile = codecs.open(args.test_file, 'r', encoding='utf-8')
         text = testFile.read().split("\n")
         assert(len(best_inferers) == len(text))
         suggested = aligner.predict(testFile)
@@ -19,18 +19,175 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import hashlib
+import mmap
+import multiprocessing
+import os
 import spacy
+import struct
+
+from itertools import izip
+from tokens import Lexicon, Sentence
+
+# record header: sha1 of the sentence, length of the serialized parse
+HEADER = struct.Struct(b"<20sI")
+# bump when the record format changes, old caches are then left alone
+RECORD_VERSION = 2
+
+class ParseCache:
+    """
+    Append-only file of Sentence records, one per (model, sentence) pair.
+    Only the record headers are read on open; parses are read lazily out of
+    a memory map.
+    path : string               Cache file, named after the model
+    index : (string, int) dict  sha1 of sentence -> (offset, length)
+    """
+    def __init__(self, cacheDir, modelKey):
+        try:
+            os.mkdir(cacheDir)
+        except OSError:
+            # directory already exists
+            pass
+        self.path = os.path.join(cacheDir, "{}.bin".format(modelKey))
+        self.index = {}
+        self.mapped = None
+        open(self.path, 'ab').close()
+        with open(self.path, 'rb') as f:
+            offset = 0
+            header = f.read(HEADER.size)
+            while len(header) == HEADER.size:
+                (digest, length) = HEADER.unpack(header)
+                offset += HEADER.size
+                if (offset + length > os.path.getsize(self.path)):
+                    # torn write from an interrupted run
+                    break
+                self.index[digest] = (offset, length)
+                offset += length
+                f.seek(offset)
+                header = f.read(HEADER.size)
+        self.appender = open(self.path, 'r+b')
+        self.appender.seek(offset)
+        self.appender.truncate()
+
+    def key(self, sentence):
+        return hashlib.sha1(sentence.encode("utf-8")).digest()
+
+    def get(self, sentence):
+        digest = self.key(sentence)
+        if digest not in self.index:
+            return None
+        (offset, length) = self.index[digest]
+        if (self.mapped is None or offset + length > len(self.mapped)):
+            self.appender.flush()
+            self.mapped = mmap.mmap(self.appender.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mapped[offset:offset + length]
+
+    def put(self, sentence, data):
+        digest = self.key(sentence)
+        if digest in self.index:
+            return
+        self.appender.write(HEADER.pack(digest, len(data)))
+        self.index[digest] = (self.appender.tell(), len(data))
+        self.appender.write(data)
+
+    def __contains__(self, sentence):
+        return self.key(sentence) in self.index
+
+# model of a parseCorpus worker process
+workerParser = None
+
+def initWorker():
+    # forked workers inherit the model of the parent
+    global workerParser
+    if (workerParser is None):
+        workerParser = spacy.load('en')
+
+def parseBatch(batch):
+    # runs in a worker, parses come back as Sentence records
+    return [Sentence.fromDoc(parseTree, Lexicon()).toRecord()
+            for parseTree in workerParser.pipe(batch, batch_size=len(batch))]
+
+def batches(sentences, batchSize):
+    batch = []
+    for sentence in sentences:
+        batch.append(sentence)
+        if (len(batch) == batchSize):
+            yield batch
+            batch = []
+    if (len(batch) > 0):
+        yield batch
 
 class Parser:
     """
     Create room for custom reparsing
+    Parses are memoized in memory, or in a ParseCache on disk if cacheDir is
+    given, so each sentence is parsed once across iterations and runs.
+    Parses are returned as Sentences, spaCy objects do not leave this class.
     """
     
-    def __init__(self):
+    def __init__(self, cacheDir=None):
         self.parser = spacy.load('en')
+        self.lexicon = Lexicon()
+        self.parsed = {}
+        self.cache = None
+        if (cacheDir is not None):
+            self.cache = ParseCache(cacheDir, self.modelKey())
        
+    def modelKey(self):
+        # parses are only reusable with the same model, spaCy version and format
+        meta = getattr(self.parser, 'meta', None) or {}
+        return "{}_{}-{}_spacy{}_r{}".format(
+            meta.get('lang', 'en'), meta.get('name', 'default'),
+            meta.get('version', 'unknown'), spacy.about.__version__, RECORD_VERSION)
+
     def parse(self, sentence):
-        return self.parser(sentence)
+        if (self.cache is None):
+            if sentence not in self.parsed:
+                self.parsed[sentence] = Sentence.fromDoc(self.parser(sentence), self.lexicon)
+            return self.parsed[sentence]
+        data = self.cache.get(sentence)
+        if data is not None:
+            return Sentence.fromRecord(data, self.lexicon)
+        parseTree = Sentence.fromDoc(self.parser(sentence), self.lexicon)
+        self.cache.put(sentence, parseTree.toRecord())
+        return parseTree
+
+    def parseCorpus(self, sentences, batchSize=1000, workers=1):
+        """
+        Streams sentences through nlp.pipe in batches of batchSize, on workers
+        processes if workers > 1. Yields parses in the order of sentences.
+        """
+        if (workers <= 1):
+            for parseTree in self.parser.pipe(sentences, batch_size=batchSize):
+                yield Sentence.fromDoc(parseTree, self.lexicon)
+            return
+        global workerParser
+        workerParser = self.parser
+        pool = multiprocessing.Pool(workers, initWorker)
+        try:
+            for batch in pool.imap(parseBatch, batches(sentences, batchSize)):
+                for data in batch:
+                    yield Sentence.fromRecord(data, self.lexicon)
+        finally:
+            pool.terminate()
+
+    def fill(self, sentences, batchSize=1000, workers=1):
+        """
+        Parse everything that is not cached yet, up front
+        """
+        seen = set()
+        todo = []
+        for sentence in sentences:
+            if (sentence in seen or sentence in self.parsed or
+                (self.cache is not None and sentence in self.cache)):
+                continue
+            seen.add(sentence)
+            todo.append(sentence)
+        for (sentence, parseTree) in izip(todo, self.parseCorpus(todo, batchSize, workers)):
+            if (self.cache is None):
+                self.parsed[sentence] = parseTree
+            else:
+                self.cache.put(sentence, parseTree.toRecord())
     
 
     def createDAG(self, parseTree):
@@ -39,7 +196,7 @@ class Parser:
         returns stack that can be traversed bottom up
         """
 
-        stack = [sent.root for sent in parseTree.sents]
+        stack = parseTree.roots()
         for token in stack:
-            stack.extend(list(token.children))
+            stack.extend(parseTree.children(token))
         return reversed(stack)
@@ -19,17 +19,31 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import spacy
 from collections import defaultdict
-from structures import Structure
+from structures import *
 
-class Relation:
+class Relation(object):
     """
     single structure, contains list of structures
+    Aggregates over the structures are kept up to date in addStructure so
+    that scoring and consensus do not rescan them:
+    orths, lemmas, heads, poses : string -> int   Member counts per feature
+    edgeCounts : string -> (int -> int)           Label -> number of children
+                                                  -> number of members
+    indexAt : int -> int                          Edition -> token index
+    childAt : (int, int) -> string                (edition, index) of a member's
+                                                  child -> edge label
+    argIds : (string, int, float) list            args as (edge label, index of
+                                                  the child relation, weight)
     """
+    __slots__ = ("ed", "i", "structures", "structureBuffer", "stringify",
+                 "predicts", "score", "canon", "args", "argIds", "pos", "rules",
+                 "orths", "lemmas", "heads", "poses", "edgeCounts",
+                 "indexAt", "childAt")
+
     def __init__(self, structure):
         self.ed = structure.ed # only for indexing reasons
-        self.name = structure.name # only for hashing purposes
+        self.i = structure.i # token index in edition ed
         self.structures = {}
         self.structureBuffer = [(structure, 0)]
         self.stringify = ""
@@ -37,12 +51,39 @@ class Relation:
         self.score = 0
         self.canon = None
         self.args = None
+        self.argIds = None
         self.pos = None
         self.rules = None
+        self.orths = defaultdict(int)
+        self.lemmas = defaultdict(int)
+        self.heads = defaultdict(int)
+        self.poses = defaultdict(int)
+        self.edgeCounts = {}
+        self.indexAt = {}
+        self.childAt = {}
+
+    def invalidate(self):
+        # drop what toString, getEdges and getString cached
+        self.stringify = ""
+        self.canon = None
+        self.args = None
+        self.argIds = None
+        self.pos = None
 
     def addStructure(self, structure):
+        self.invalidate()
         self.structures[structure[0].ed] = structure[0]
         self.score += structure[1]
+        s = structure[0]
+        self.orths[s.orth()] += 1
+        self.lemmas[s.lemma()] += 1
+        self.heads[s.headOrth()] += 1
+        self.poses[s.pos] += 1
+        self.indexAt[s.ed] = s.i
+        for (edge, tokens) in s.args.items():
+            self.edgeCounts.setdefault(edge, defaultdict(int))[len(tokens)] += 1
+            for token in tokens:
+                self.childAt[(s.ed, token)] = edge
         
         
     def flushBuffer(self):
@@ -56,9 +97,14 @@ class Relation:
 
     def pickConsensus(self):
         # need to deal with children, for now just returns name
+        best = max(self.orths.values())
+        winners = [name for (name, count) in self.orths.items() if count == best]
+        if (len(winners) == 1):
+            return winners[0]
+        # ties are broken by the order of a recount, as they always were
         names = defaultdict(int)
         for s in self.structures.values():
-            names[s.name.orth_] += 1
+            names[s.orth()] += 1
         # pick most common name
         # pick most common tags
         # what to do about args?
@@ -73,16 +119,34 @@ class Relation:
         self: relation
         structure: new thing (structure)
         """
-        # pairwise scores:
-        pairwiseScores = sum([sum(structure.scoreWith(s, suggested).values()) 
-                              for s in self.structures.values()])/(len(self.structures))
+        # pairwise scores, summed over members from the aggregates:
+        pairwiseScores = (IDENTITY_SCORE * self.orths.get(structure.orth(), 0) +
+                          LEMMA_SCORE * self.lemmas.get(structure.lemma(), 0) +
+                          PARENT_SCORE * self.heads.get(structure.headOrth(), 0) +
+                          POS_SCORE * self.poses.get(structure.pos, 0))
+        for (ed, i) in self.indexAt.items():
+            if (i in suggested[ed][structure.i]):
+                pairwiseScores += ALIGN_SCORE
+        for (edge, tokens) in structure.args.items():
+            if edge not in self.edgeCounts:
+                continue
+            # shared edges, min(number of children) for each member
+            for (count, members) in self.edgeCounts[edge].items():
+                pairwiseScores += members * min(count, len(tokens))
+            # aligned children
+            for child in tokens:
+                for ed in self.indexAt:
+                    for j in set(suggested[ed][child]):
+                        if (self.childAt.get((ed, j)) == edge):
+                            pairwiseScores += CHILD_ALIGN_SCORE
+        pairwiseScores = pairwiseScores/(len(self.structures))
         
         # global scores: 
-        childrenScores = sum([parentsMatrixAtHere[child.i] for child in structure.name.children])
+        childrenScores = sum([parentsMatrixAtHere[child] for child in structure.children()])
         # "How likely am I the parent of my children?"
         
 
-        # print ("{}:R, {}:S, word={}, child={}".format(self.finalString(), structure.name,
+        # print ("{}:R, {}:S, word={}, child={}".format(self.finalString(), structure,
         #                                               wordFeatures, childrenFeatures))
         return pairwiseScores + childrenScores
  
@@ -94,16 +158,30 @@ class Relation:
                 self.getString(), edges[0], edges[1])
         return self.stringify
 
+    def toRecord(self, relationIdx, backMap, relations):
+        """
+        returns the predicate as a dict for predicates.jsonl
+        """
+        (pos, _) = self.getEdges(backMap, relations)
+        return {
+            "id": relationIdx,
+            "string": self.getString(),
+            "pos": pos,
+            "args": [{"edge": edge, "target": target, "string": relations[target].getString(),
+                      "weight": weight}
+                     for (edge, target, weight) in sorted(self.argIds)],
+        }
+
     def toList(self, size):
         output = ["" for _ in xrange(size)]
         for s in self.structures.values():
-            output[s.ed] = (u"({}, {})".format(s.name, s.name.i))
+            output[s.ed] = (u"({}, {})".format(s, s.i))
         if len(self.predicts) > 0:
             output.extend(self.predicts)
         return output
     
     def extractRules(self):
-        self.rules = set([s.name.orth_ for s in self.structures.values()])
+        self.rules = set([s.orth() for s in self.structures.values()])
         return self.rules
 
     def getRules(self):
@@ -121,20 +199,23 @@ class Relation:
             allPOS[s.pos] += 1
             for (e, tokens) in s.args.items():
                 for tok in tokens:
-                    if (ed, tok.i) in backMap:
-                        allEdges[e][backMap[(ed, tok.i)]] += 1
+                    if (ed, tok) in backMap:
+                        allEdges[e][backMap[(ed, tok)]] += 1
 
         # most common POS tag:
         self.pos = max(allPOS, key=allPOS.get)
 
         # most common edges
         self.args = set()
+        self.argIds = []
         for edge in allEdges.keys():
             k = int(0.5 + (sum(allEdges[edge].values())/float(len(self.structures))))
             for i in xrange(k):
                 newRi = max(allEdges[edge], key=allEdges[edge].get)
+                weight = allEdges[edge][newRi]/float(len(self.structures))
                 self.args.add((edge, relations[newRi].finalString(), 
-                               "{:.2f}".format(allEdges[edge][newRi]/float(len(self.structures)))))
+                               "{:.2f}".format(weight)))
+                self.argIds.append((edge, newRi, weight))
                 allEdges[edge].pop(newRi)
 
         
@@ -0,0 +1,160 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# runs the per-row inferers of an iteration on worker processes
+
+import multiprocessing
+import traceback
+
+from inferer import Inferer
+from tokens import Sentence
+
+def serveRows(conn, lo, hi):
+    """
+    Worker loop. Owns the inferers of rows lo..hi-1 and answers messages:
+    ("start", perm, best, frozen)
+                           new inferers for an iteration, best holds the
+                           best score of each owned row so far (or None),
+                           frozen whether the row is left alone
+    ("infer", rows)        rows = (sentence record, suggested) per owned row,
+                           None for frozen rows
+    ("finish",)            send back rules, scores and the improved inferers,
+                           frozen rows keep their best score and get no rules
+    ("stop",)              exit
+    """
+    inferers = []
+    rules = []
+    bestScores = []
+    frozen = []
+    failure = None
+    while True:
+        message = conn.recv()
+        if (message[0] == "start"):
+            inferers = [Inferer(message[1]) for _ in xrange(lo, hi)]
+            rules = [[] for _ in xrange(lo, hi)]
+            bestScores = message[2]
+            frozen = message[3]
+            failure = None
+        elif (message[0] == "infer"):
+            if (failure is not None):
+                continue
+            try:
+                for (k, row) in enumerate(message[1]):
+                    if (row is None):
+                        continue
+                    (record, suggested) = row
+                    inferer = inferers[k]
+                    inferer.infer(Sentence.fromRecord(record, inferer.lexicon), suggested)
+                    rules[k].extend(inferer.extractRules())
+            except Exception:
+                failure = traceback.format_exc()
+        elif (message[0] == "finish"):
+            if (failure is not None):
+                conn.send(("error", failure))
+                continue
+            scores = []
+            improved = {}
+            for (k, inferer) in enumerate(inferers):
+                if (frozen[k]):
+                    scores.append(bestScores[k])
+                    continue
+                inferer.score()
+                scores.append(inferer.getScore())
+                if (bestScores[k] is None or bestScores[k] < inferer.getScore()):
+                    bestScores[k] = inferer.getScore()
+                    improved[lo + k] = inferer
+            conn.send(("done", rules, scores, improved))
+        elif (message[0] == "stop"):
+            conn.close()
+            return
+
+class RowWorkers:
+    """
+    Persistent worker processes, each owning a contiguous block of rows for
+    the whole run. Only the slice of each file and its alignments that a
+    worker owns is sent to it; inferers come back only when they beat the
+    best score of their row.
+    size : int                  Number of rows
+    bounds : int list           Worker k owns rows bounds[k]..bounds[k+1]-1
+    conns : Connection list     Parent end of each worker's pipe
+    frozen : bool list          Rows left alone in this iteration
+    """
+    def __init__(self, size, workers):
+        self.size = size
+        self.bounds = [size * k // workers for k in xrange(workers + 1)]
+        self.conns = []
+        self.processes = []
+        self.frozen = [False] * size
+        for k in xrange(workers):
+            (parentEnd, childEnd) = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=serveRows, args=(childEnd, self.bounds[k], self.bounds[k+1]))
+            process.daemon = True
+            process.start()
+            childEnd.close()
+            self.conns.append(parentEnd)
+            self.processes.append(process)
+
+    def start(self, perm, bestScores, frozen=None):
+        # bestScores: best score of each row so far, None if there is none
+        # frozen: rows that are neither parsed nor inferred in this iteration
+        self.frozen = frozen if frozen is not None else [False] * self.size
+        for (k, conn) in enumerate(self.conns):
+            (lo, hi) = (self.bounds[k], self.bounds[k+1])
+            conn.send(("start", list(perm), bestScores[lo:hi], self.frozen[lo:hi]))
+
+    def infer(self, parser, filei, alignments):
+        """
+        Hand the rows of an aligned file to their workers. Returns as soon as
+        every worker has taken its slice; inference runs in the background.
+        """
+        for (k, conn) in enumerate(self.conns):
+            rows = [None if self.frozen[row] else
+                    (parser.parse(filei[row]).toRecord(), [ed[row] for ed in alignments])
+                    for row in xrange(self.bounds[k], self.bounds[k+1])]
+            conn.send(("infer", rows))
+
+    def finish(self):
+        """
+        Wait for the iteration to end
+        returns:
+        rule list per row
+        score per row
+        row -> inferer dict of the rows that improved on their best score
+        """
+        for conn in self.conns:
+            conn.send(("finish",))
+        rules = []
+        scores = []
+        improved = {}
+        for conn in self.conns:
+            reply = conn.recv()
+            if (reply[0] == "error"):
+                raise RuntimeError("Inference worker failed:\n{}".format(reply[1]))
+            rules.extend(reply[1])
+            scores.extend(reply[2])
+            improved.update(reply[3])
+        return (rules, scores, improved)
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(("stop",))
+        for process in self.processes:
+            process.join()
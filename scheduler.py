@@ -0,0 +1,83 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# runs pairwise alignments on a pool of worker processes or in the
+# background of inference
+
+import multiprocessing
+import threading
+import Queue
+
+class AlignmentScheduler:
+    """
+    Bounded pool of alignment workers. Jobs are keyed by (fileiIdx, filejIdx)
+    and the caller only blocks on the pairs it actually needs.
+    jobs : int                  Number of worker processes
+    pending : (int, int) dict   Outstanding jobs, pair -> AsyncResult
+    """
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.pool = multiprocessing.Pool(jobs)
+        self.pending = {}
+
+    def submit(self, pair, func, args):
+        # func has to be module level so it can be pickled
+        self.pending[pair] = self.pool.apply_async(func, args)
+
+    def wait(self, pair):
+        # re-raises anything the worker raised
+        if pair in self.pending:
+            self.pending.pop(pair).get()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+class AlignmentPipeline(threading.Thread):
+    """
+    Producer thread that aligns files one after another and hands the results
+    to the consumer in file order. The queue is bounded so that only depth
+    files worth of alignments are held at once.
+    produce : int -> item       Aligns the fileiIdxth file
+    numFiles : int              Number of files to produce
+    queue : Queue               Produced items, or the exception that stopped
+                                the producer
+    """
+    def __init__(self, produce, numFiles, depth):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.produce = produce
+        self.numFiles = numFiles
+        self.queue = Queue.Queue(depth)
+
+    def run(self):
+        for fileiIdx in xrange(self.numFiles):
+            try:
+                item = self.produce(fileiIdx)
+            except Exception, e:
+                self.queue.put(e)
+                return
+            self.queue.put(item)
+
+    def __iter__(self):
+        for _ in xrange(self.numFiles):
+            item = self.queue.get()
+            if isinstance(item, Exception):
+                raise item
+            yield item
@@ -0,0 +1,135 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Vectorized version of Relation.scoreWith for all (structure, relation)
+# pairs of a verse at once.
+
+import numpy as np
+
+from structures import *
+
+class Interner:
+    """
+    Maps strings to small ints so features can be compared as arrays
+    """
+    def __init__(self):
+        self.ids = {}
+
+    def __call__(self, string):
+        if string not in self.ids:
+            self.ids[string] = len(self.ids)
+        return self.ids[string]
+
+def scoreMatrix(structures, relations, suggested, parentMatrix):
+    """
+    structures: new Structures of the sentence being added
+    relations: Relations of the inferer
+    suggested: 2d alignment array
+    parentMatrix: see Inferer.createParentMatrix
+    Returns |structures| x |relations| array where
+    scores[s][r] = relations[r].scoreWith(structures[s], suggested, parentMatrix[r])
+    """
+    (sIdxs, rIdxs) = np.indices((len(structures), len(relations)))
+    return scorePairs(structures, relations, suggested, parentMatrix,
+                      sIdxs.ravel(), rIdxs.ravel()).reshape(sIdxs.shape)
+
+def scorePairs(structures, relations, suggested, parentMatrix, sIdxs, rIdxs):
+    """
+    Same as scoreMatrix, but only for the pairs (sIdxs[k], rIdxs[k]).
+    Member sums come from the per-relation aggregates, so the cost does not
+    grow with the number of editions in a relation.
+    """
+    sIdxs = np.asarray(sIdxs, dtype=np.int64)
+    rIdxs = np.asarray(rIdxs, dtype=np.int64)
+    if (len(sIdxs) == 0):
+        return np.zeros(0)
+    pairwise = np.zeros(len(sIdxs), dtype=np.int64)
+
+    # id, lemma, parent, pos: gather the member counts of each new value
+    features = [(IDENTITY_SCORE, lambda s: s.orth(), lambda r: r.orths),
+                (LEMMA_SCORE, lambda s: s.lemma(), lambda r: r.lemmas),
+                (PARENT_SCORE, lambda s: s.headOrth(), lambda r: r.heads),
+                (POS_SCORE, lambda s: s.pos, lambda r: r.poses)]
+    for (weight, value, aggregate) in features:
+        intern = Interner()
+        new = np.array([intern(value(s)) for s in structures])
+        counts = np.zeros((len(relations), len(intern.ids)), dtype=np.int64)
+        for r in np.unique(rIdxs):
+            for (key, count) in aggregate(relations[r]).items():
+                if key in intern.ids:
+                    counts[r, intern.ids[key]] = count
+        pairwise += weight * counts[rIdxs, new[sIdxs]]
+
+    # align and aligned children, looked up through the suggested alignments
+    memberAt = {}
+    childOf = {}
+    for (r, relation) in enumerate(relations):
+        for (ed, i) in relation.indexAt.items():
+            memberAt[(ed, i)] = r
+        for (key, edge) in relation.childAt.items():
+            childOf[key] = (r, edge)
+    aligned = np.zeros((len(structures), len(relations)), dtype=np.int64)
+    for n in np.unique(sIdxs):
+        s = structures[n]
+        for ed in xrange(len(suggested)):
+            for j in set(suggested[ed][s.i]):
+                if (ed, j) in memberAt:
+                    aligned[n, memberAt[(ed, j)]] += ALIGN_SCORE
+        for (edge, tokens) in s.args.items():
+            for token in tokens:
+                for ed in xrange(len(suggested)):
+                    for j in set(suggested[ed][token]):
+                        if (ed, j) in childOf and childOf[(ed, j)][1] == edge:
+                            aligned[n, childOf[(ed, j)][0]] += CHILD_ALIGN_SCORE
+    pairwise += aligned[sIdxs, rIdxs]
+
+    # shared edges: sum over members of min(number of children) per label,
+    # tabulated for every number of children a new structure can have
+    labels = Interner()
+    for s in structures:
+        for edge in s.args.keys():
+            labels(edge)
+    newEdges = np.zeros((len(structures), len(labels.ids)), dtype=np.int64)
+    for (n, s) in enumerate(structures):
+        for (edge, tokens) in s.args.items():
+            newEdges[n, labels.ids[edge]] = len(tokens)
+    mostChildren = newEdges.max() if newEdges.size > 0 else 0
+    mins = np.zeros((len(relations), len(labels.ids), mostChildren + 1), dtype=np.int64)
+    wanted = np.arange(mostChildren + 1)
+    for r in np.unique(rIdxs):
+        for (edge, counts) in relations[r].edgeCounts.items():
+            if edge in labels.ids:
+                for (count, members) in counts.items():
+                    mins[r, labels.ids[edge]] += members * np.minimum(wanted, count)
+    for label in xrange(len(labels.ids)):
+        pairwise += mins[rIdxs, label, newEdges[sIdxs, label]]
+
+    # average over the members of each relation
+    sizes = np.array([len(relation.structures) for relation in relations])
+    scores = pairwise / sizes[rIdxs]
+
+    # "How likely am I the parent of my children?"
+    parents = np.array(parentMatrix, dtype=np.float64).reshape(len(relations), -1)
+    childrenScores = np.zeros(len(sIdxs))
+    for n in np.unique(sIdxs):
+        here = (sIdxs == n)
+        for child in structures[n].children():
+            childrenScores[here] += parents[rIdxs[here], child]
+    return scores + childrenScores
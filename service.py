@@ -0,0 +1,273 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Serves the consensus of a finished run over HTTP. Lines of a new edition
+# are aligned to the same rows of the run's editions and mapped onto the
+# relations of each row's best inferer with Inferer.mapTokens, which leaves
+# the inferers untouched. The aligner is trained once, pooled over the
+# run's editions (see Backend.trainOnce), and batches are only decoded with
+# those parameters. Requests of concurrent clients are gathered into
+# batches, so that each batch costs one decoding run for all editions.
+#
+# POST /map  {"row": 3, "text": "..."}                  -> one result
+#            {"requests": [{"row": 3, "text": "..."}]}  -> {"results": [...]}
+# GET /health                                           -> rows and editions
+#
+# A result is {"row": 3, "relations": [{"relation": r, "key": k, "word": w}]}
+# with one entry per relation that a word of the line is matched to.
+
+import argparse
+import backends
+import BaseHTTPServer
+import checkpoint
+import codecs
+import json
+import os
+import Queue
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from aligner import Aligner
+from alignstore import AlignmentStore
+
+class Mapper:
+    """
+    Maps lines of a new edition onto the relations of a run
+    aligner : Aligner           Editions of the run, in file order
+    inferers : Inferer list     Best inferer of each row
+    rules : string              Rule lines of the run, added to every bitext
+    lines : string list list    Lines of each edition
+    workDir : string            Scratch directory of the aligner runs
+    The backend of aligner is expected to be trained once, pooled, so that
+    every pair decodes with the same parameters.
+    """
+    def __init__(self, aligner, inferers, rules):
+        self.aligner = aligner
+        self.inferers = inferers
+        self.rules = rules
+        for f in aligner.fileList:
+            f.seek(0)
+        self.lines = [aligner.read(fileIdx) for fileIdx in xrange(aligner.numFiles)]
+        self.workDir = tempfile.mkdtemp(prefix="monolign_service")
+
+    def close(self):
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def writeLines(self, fileName, lines):
+        with codecs.open(fileName, 'w', "utf-8") as f:
+            f.write("".join(["{}\n".format(line) for line in lines]))
+
+    def mapBatch(self, items):
+        """
+        items : (row, text) list
+        returns a result per item, see above
+        """
+        # one bitext for all editions: the batch against edition 0, then 1, ...
+        numItems = len(items)
+        batchFile = os.path.join(self.workDir, "batch.txt")
+        self.writeLines(batchFile, [text for (_, text) in items] * self.aligner.numFiles)
+        editionFile = os.path.join(self.workDir, "editions.txt")
+        self.writeLines(editionFile, [self.lines[fileIdx][row]
+                                      for fileIdx in xrange(self.aligner.numFiles)
+                                      for (row, _) in items])
+        prefix = os.path.join(self.workDir, "batch")
+        self.aligner.backend.align(batchFile, editionFile, "{}tmp".format(prefix),
+                                   prefix, self.rules)
+        store = AlignmentStore("{}.bin".format(prefix), numItems * self.aligner.numFiles)
+        results = []
+        for (k, (row, text)) in enumerate(items):
+            inferer = self.inferers[row]
+            matches = inferer.mapTokens(text.split(), [
+                store[fileIdx * numItems + k] for fileIdx in xrange(self.aligner.numFiles)])
+            results.append({
+                "row": row,
+                "relations": [{"relation": relationIdx,
+                               "key": inferer.relations[relationIdx].getString(),
+                               "word": matches[relationIdx]}
+                              for relationIdx in sorted(matches)],
+            })
+        return results
+
+class Pending:
+    # items of one request, done is set once results or error is
+    def __init__(self, items):
+        self.items = items
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+class Batcher(threading.Thread):
+    """
+    Runs the Mapper on batches of the pending requests: a batch is closed
+    window seconds after its first request or once it holds maxBatch lines
+    """
+    def __init__(self, mapper, window, maxBatch):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.mapper = mapper
+        self.window = window
+        self.maxBatch = maxBatch
+        self.queue = Queue.Queue()
+
+    def submit(self, items):
+        # blocks until the items are mapped
+        pending = Pending(items)
+        self.queue.put(pending)
+        pending.done.wait()
+        if (pending.error is not None):
+            raise RuntimeError(pending.error)
+        return pending.results
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            size = len(batch[0].items)
+            deadline = time.time() + self.window
+            while (size < self.maxBatch):
+                try:
+                    pending = self.queue.get(timeout=max(0, deadline - time.time()))
+                except Queue.Empty:
+                    break
+                batch.append(pending)
+                size += len(pending.items)
+            try:
+                results = self.mapper.mapBatch(
+                    [item for pending in batch for item in pending.items])
+                for pending in batch:
+                    pending.results = results[:len(pending.items)]
+                    results = results[len(pending.items):]
+            except Exception:
+                for pending in batch:
+                    pending.error = traceback.format_exc()
+            for pending in batch:
+                pending.done.set()
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def reply(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "{}".format(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if (self.path != "/health"):
+            return self.reply(404, {"error": "unknown path {}".format(self.path)})
+        mapper = self.server.batcher.mapper
+        self.reply(200, {"rows": mapper.aligner.size,
+                         "editions": mapper.aligner.numFiles})
+
+    def do_POST(self):
+        if (self.path != "/map"):
+            return self.reply(404, {"error": "unknown path {}".format(self.path)})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+            requests = body["requests"] if "requests" in body else [body]
+            # tokens as the aligner backends split them, see backends.linePairs
+            items = [(int(request["row"]), " ".join(request["text"].split()))
+                     for request in requests]
+        except (ValueError, KeyError, TypeError, AttributeError), e:
+            return self.reply(400, {"error": "bad request: {}".format(e)})
+        size = self.server.batcher.mapper.aligner.size
+        for (row, _) in items:
+            if not (0 <= row < size):
+                return self.reply(400, {"error": "row {} is not in 0..{}".format(row, size - 1)})
+        try:
+            results = self.server.batcher.submit(items)
+        except RuntimeError, e:
+            return self.reply(500, {"error": "{}".format(e)})
+        self.reply(200, {"results": results} if "requests" in body else results[0])
+
+    def log_message(self, format, *args):
+        if (self.server.verbose):
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def parseArgs():
+    argparser = argparse.ArgumentParser(description="Map lines of a new edition onto the "
+                                        "consensus of a finished monolign run")
+    argparser.add_argument("run_dir", help="_aligns directory of the run")
+    argparser.add_argument("data_dir", help="data directory the run was started on")
+    argparser.add_argument("aligner", help="location of fast_align (unused by --backend model2)")
+    argparser.add_argument("--backend", choices=backends.BACKENDS, default="fast_align",
+                           help="pairwise aligner, see monolign.py; model2 aligns in "
+                           "process and avoids starting a binary per batch")
+    argparser.add_argument("--params", default=None, metavar="DIR",
+                           help="where the pooled aligner parameters are kept, trained "
+                           "there at startup unless a run with --train-once pooled left "
+                           "them (RUN_DIR/params by default)")
+    argparser.add_argument("--host", default="127.0.0.1")
+    argparser.add_argument("--port", type=int, default=8765)
+    argparser.add_argument("--window", type=float, default=5, metavar="MS",
+                           help="how long a batch waits for more requests")
+    argparser.add_argument("--max-batch", type=int, default=64,
+                           help="most lines aligned together")
+    argparser.add_argument("--verbose", action="store_true", help="log every request")
+    return argparser.parse_args()
+
+if __name__ == "__main__":
+    args = parseArgs()
+    state = checkpoint.latest(args.run_dir)
+    if (state is None):
+        sys.exit("No checkpoint in {}".format(args.run_dir))
+    backend = backends.FastAlignBackend(args.aligner)
+    if (args.backend == backends.Model2Backend.name):
+        backend = backends.Model2Backend()
+    aligner = Aligner(sys.argv[0], args.data_dir, args.aligner, backend, newDir=args.run_dir)
+    if not checkpoint.restoreEditions(state, aligner):
+        sys.exit("{} was run on other editions than {}".format(args.run_dir, args.data_dir))
+    aligner.perm = range(aligner.numFiles)
+    params = args.params if args.params is not None else os.path.join(args.run_dir, "params")
+    # trained on the first start, loaded afterwards
+    pooled = os.path.join(params, "pooled.{}".format(backend.suffix))
+    if (backends.trainedFlags(params) is None and os.path.isdir(params) and
+        len(os.listdir(params)) > 0 and not os.path.exists(pooled)):
+        # parameters of a run from before flags were recorded, per pair at that
+        sys.exit("{} holds aligner parameters but no {}, pass --params DIR to train "
+                 "the service's own".format(params, os.path.basename(pooled)))
+    if (backends.trainedFlags(params) is None):
+        print ("Training pooled aligner parameters in {}".format(params))
+    try:
+        backend.trainOnce(params, True, [f.name for f in aligner.fileList])
+    except ValueError, e:
+        sys.exit("{}; pass --params DIR to train the service's own".format(e))
+    mapper = Mapper(aligner, state["best_inferers"], aligner.formatRules([], state["base_rules"]))
+    batcher = Batcher(mapper, args.window / 1000, args.max_batch)
+    batcher.start()
+    server = Server((args.host, args.port), Handler)
+    server.batcher = batcher
+    server.verbose = args.verbose
+    print ("Serving {} rows of {} on http://{}:{}".format(
+        aligner.size, args.run_dir, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        mapper.close()
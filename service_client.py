@@ -0,0 +1,61 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Client of service.py. Maps every line of an edition, line i onto row i,
+# and prints one JSON result per line:
+# python service_client.py http://127.0.0.1:8765 EDITION --batch 16
+
+import argparse
+import codecs
+import json
+import sys
+import urllib2
+
+def post(url, body):
+    request = urllib2.Request("{}/map".format(url.rstrip("/")), json.dumps(body).encode("utf-8"),
+                              {"Content-Type": "application/json"})
+    return json.loads(urllib2.urlopen(request).read())
+
+def mapLine(url, row, text):
+    return post(url, {"row": row, "text": text})
+
+def mapLines(url, items):
+    """
+    items : (row, text) list
+    returns a result per item, see service.py
+    """
+    body = {"requests": [{"row": row, "text": text} for (row, text) in items]}
+    return post(url, body)["results"]
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Map an edition with service.py")
+    argparser.add_argument("url")
+    argparser.add_argument("edition")
+    argparser.add_argument("--batch", type=int, default=1, help="lines per request")
+    args = argparser.parse_args()
+    with codecs.open(args.edition, 'r', "utf-8") as f:
+        lines = f.read().split("\n")
+    if (len(lines) > 0 and len(lines[-1]) == 0):
+        lines.pop()
+    items = list(enumerate(lines))
+    for start in xrange(0, len(items), args.batch):
+        for result in mapLines(args.url, items[start:start + args.batch]):
+            print (json.dumps(result, ensure_ascii=False).encode("utf-8"))
+            sys.stdout.flush()
@@ -18,20 +18,25 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import spacy
-from collections import defaultdict
-
 ALIGN_SCORE = 1
 CHILD_ALIGN_SCORE = 1
+IDENTITY_SCORE = 3
+LEMMA_SCORE = 1
+PARENT_SCORE = 1
+POS_SCORE = 1
 DEBUG = False
 SHOULD_IGNORE = []
 
-class Structure:
+class Structure(object):
     """
     HEAD [tags] (edge1 -> token, edge2 -> token, edge3 -> token...)
     special rules are used for certain edge types
     -> does not necessarily follow tree edges
+    The head is token i of sentence, and args hold the indices of its
+    children by edge label.
     """
+    __slots__ = ("sentence", "i", "ed", "pos", "args")
+    tags = () # possible morphosyntactic features
     # empty is a leftover function, probably not needed.
     # def empty(edition = -1):
     #     self.name = ""
@@ -42,21 +47,46 @@ class Structure:
     #     self.bestScore = 0???
 
 
-    def __init__(self, token, edition):        
-        self.name = token
-        self.counter = token.i + 1
-        self.tags = {} # possible morphosyntactic features
-        self.pos = token.pos_
-        self.args = defaultdict(list)
-        for left in token.lefts:
-            self.args[left.dep_].append(left)
-        for right in token.rights:
-            self.args[right.dep_].append(right)
+    def __init__(self, sentence, i, edition):        
+        self.sentence = sentence
+        self.i = i
+        self.pos = sentence.pos(i)
+        self.args = {}
+        for child in sentence.children(i):
+            self.args.setdefault(sentence.dep(child), []).append(child)
         self.ed = edition # purely for indexing reasons
 
     def shouldIgnore(self):
         return (self.pos in SHOULD_IGNORE)
 
+    def orth(self):
+        return self.sentence.orth(self.i)
+
+    def lemma(self):
+        return self.sentence.lemma(self.i)
+
+    def tag(self):
+        return self.sentence.tag(self.i)
+
+    def head(self):
+        return self.sentence.head(self.i)
+
+    def headOrth(self):
+        return self.sentence.orth(self.sentence.head(self.i))
+
+    def children(self):
+        return self.sentence.children(self.i)
+
+    def string(self):
+        return self.sentence.string(self.i)
+
+    # prints like the spaCy token it was made from
+    def __unicode__(self):
+        return self.string()
+
+    def __str__(self):
+        return self.string().encode("utf-8")
+
     def sim(self, s2, s2Alignments):
         # This comment is about similarity in general:
         # may want to look at children properties
@@ -80,7 +110,7 @@ class Structure:
             edgeScore = min(len(ownSet), len(s2Set)) # approximation - could be weighted
             for token1 in ownSet:
                 for token2 in s2Set:
-                    if (token2.i in s2Alignments[token1.i]):
+                    if (token2 in s2Alignments[token1]):
                         edgeScore += CHILD_ALIGN_SCORE             # yet another weight
             score += edgeScore
         return score
@@ -95,25 +125,25 @@ class Structure:
         # do some evaluation calculating similarity of trees, 
         #use their scores, increase scores based on alignment
         if (DEBUG):
-            print (self.name, s2.name)
-            print (s2.name.i, self.name.i, alignments[s2.ed])
+            print (self, s2)
+            print (s2.i, self.i, alignments[s2.ed])
 
         align_score = 0
-        if (s2.name.i in alignments[s2.ed][self.name.i]):
+        if (s2.i in alignments[s2.ed][self.i]):
             align_score += ALIGN_SCORE # this could be finer grained?
         
         identity_score = 0
-        if (s2.name.orth_ == self.name.orth_):
-            identity_score = 3
+        if (s2.orth() == self.orth()):
+            identity_score = IDENTITY_SCORE
         lemma_score = 0
-        if (s2.name.lemma_ == self.name.lemma_):
-            lemma_score = 1
+        if (s2.lemma() == self.lemma()):
+            lemma_score = LEMMA_SCORE
         parentID_score = 0
-        if (s2.name.head.orth_ == self.name.head.orth_):
-            parentID_score = 1
+        if (s2.headOrth() == self.headOrth()):
+            parentID_score = PARENT_SCORE
         pos_score = 0
         if (self.pos == s2.pos):
-            pos_score = 1
+            pos_score = POS_SCORE
 
         child_score = self.sim(s2, alignments[s2.ed]) # looks at children
 
@@ -126,11 +156,12 @@ class Structure:
         
     def toString(self):
         return u"{}.{} [{}] ({})".format(
-            self.name, self.name.tag_, 
+            self.string(), self.tag(), 
             u",".join(list(self.tags)), 
             u",".join([u"{} -> [{}]".format(
                 edge, 
-                u",".join([u"{}.{}".format(token, token.tag_) for token in tokens]))
+                u",".join([u"{}.{}".format(self.sentence.string(token), self.sentence.tag(token))
+                           for token in tokens]))
             for (edge, tokens) in self.args.items()])
         )
 
@@ -0,0 +1,170 @@
+# Copyright 2017 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# Compact parses. Instead of holding spaCy Docs and Tokens, a sentence is a
+# set of int columns into a Lexicon of interned strings, and everything
+# else refers to tokens by (edition, index).
+
+from array import array
+
+COLUMNS = ["orths", "lemmas", "tags", "poses", "deps"]
+# separators of a serialized sentence, see toRecord
+TOKEN_SEP = "\x00"
+FIELD_SEP = "\x01"
+
+class Lexicon(object):
+    """
+    Interned strings, shared by all the sentences of a verse
+    strings : string list     id -> string
+    ids : string dict         string -> id
+    """
+    __slots__ = ("strings", "ids")
+
+    def __init__(self, strings=()):
+        self.strings = []
+        self.ids = {}
+        for string in strings:
+            self.intern(string)
+
+    def intern(self, string):
+        if string not in self.ids:
+            self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self.ids[string]
+
+    def __getitem__(self, i):
+        return self.strings[i]
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getstate__(self):
+        return self.strings
+
+    def __setstate__(self, strings):
+        self.__init__(strings)
+
+class Sentence(object):
+    """
+    One parsed sentence, stored as columns
+    lexicon : Lexicon                           Strings of the columns below
+    text : string                               Sentence with its whitespace
+    orths, lemmas, tags, poses, deps : array    Lexicon ids, one per token
+    heads : array                               Index of the head of each token
+                                                (roots are their own head)
+    spaces : array                              1 if the token is followed by
+                                                whitespace
+    """
+    __slots__ = ["lexicon", "text", "heads", "spaces"] + COLUMNS
+
+    def __init__(self, lexicon, text, tokens):
+        """
+        tokens: (orth, lemma, tag, pos, dep, head, space) list
+        """
+        self.lexicon = lexicon
+        self.text = text
+        for (c, column) in enumerate(COLUMNS):
+            setattr(self, column, array(b"i", [lexicon.intern(t[c]) for t in tokens]))
+        self.heads = array(b"i", [t[5] for t in tokens])
+        self.spaces = array(b"b", [t[6] for t in tokens])
+
+    @classmethod
+    def fromDoc(cls, parseTree, lexicon):
+        return cls(lexicon, parseTree.string,
+                   [(t.orth_, t.lemma_, t.tag_, t.pos_, t.dep_, t.head.i,
+                     int(len(t.whitespace_) > 0)) for t in parseTree])
+
+    @classmethod
+    def fromRecord(cls, record, lexicon):
+        # inverse of toRecord
+        fields = record.decode("utf-8").split(TOKEN_SEP)
+        tokens = []
+        for field in fields[1:]:
+            (orth, lemma, tag, pos, dep, head, space) = field.split(FIELD_SEP)
+            tokens.append((orth, lemma, tag, pos, dep, int(head), int(space)))
+        return cls(lexicon, fields[0], tokens)
+
+    def toRecord(self):
+        # self contained utf-8 bytes, used by the parse cache and workers
+        tokens = [self.text]
+        for i in xrange(len(self)):
+            tokens.append(FIELD_SEP.join([
+                self.orth(i), self.lemma(i), self.tag(i), self.pos(i), self.dep(i),
+                "{}".format(self.heads[i]), "{}".format(self.spaces[i])]))
+        return TOKEN_SEP.join(tokens).encode("utf-8")
+
+    def intern(self, lexicon):
+        """
+        The same sentence with its strings in lexicon
+        """
+        if (lexicon is self.lexicon):
+            return self
+        return Sentence(lexicon, self.text,
+                        [(self.orth(i), self.lemma(i), self.tag(i), self.pos(i),
+                          self.dep(i), self.heads[i], self.spaces[i])
+                         for i in xrange(len(self))])
+
+    def __len__(self):
+        return len(self.heads)
+
+    def orth(self, i):
+        return self.lexicon[self.orths[i]]
+
+    def lemma(self, i):
+        return self.lexicon[self.lemmas[i]]
+
+    def tag(self, i):
+        return self.lexicon[self.tags[i]]
+
+    def pos(self, i):
+        return self.lexicon[self.poses[i]]
+
+    def dep(self, i):
+        return self.lexicon[self.deps[i]]
+
+    def head(self, i):
+        return self.heads[i]
+
+    def string(self, i):
+        # like spaCy's token.string, with trailing whitespace
+        return self.orth(i) + (" " if self.spaces[i] else "")
+
+    def children(self, i):
+        # in token order, like spaCy's lefts then rights
+        return [c for c in xrange(len(self)) if self.heads[c] == i and c != i]
+
+    def roots(self):
+        return [i for i in xrange(len(self)) if self.heads[i] == i]
+
+    def __getstate__(self):
+        return (self.lexicon, self.text,
+                [getattr(self, column).tostring()
+                 for column in COLUMNS + ["heads", "spaces"]])
+
+    def __setstate__(self, state):
+        (self.lexicon, self.text, columns) = state
+        for (column, data) in zip(COLUMNS + ["heads", "spaces"], columns):
+            typecode = b"b" if column == "spaces" else b"i"
+            values = array(typecode)
+            values.fromstring(data)
+            setattr(self, column, values)
+
+    def __unicode__(self):
+        return self.text